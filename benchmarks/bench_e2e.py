@@ -0,0 +1,142 @@
+"""
+端到端压测：离线聊天通道 + 本地模拟接口，运行 main.py 中完整的监听/防抖/调用/发送流程
+报告回复延迟（第一条未回复消息到回复发出）、吞吐和每个聊天的内存占用
+用法: python benchmarks/bench_e2e.py [--chats 50] [--rate 6] [--duration 30] [--latency 0.5] [--stream]
+      [--failure-rate 0.05]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import yaml
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_dir)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_llm_server import MockOptions, start_server  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def start_mock(options):
+    """在独立线程的事件循环中运行模拟接口，返回端口"""
+    ready = threading.Event()
+    result = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        result["runner"], result["port"] = loop.run_until_complete(start_server(options))
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name="mock-llm", daemon=True).start()
+    ready.wait()
+    return result["port"]
+
+
+def write_config(args, port):
+    with open(os.path.join(root_dir, "config.yaml"), "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    prompt_name = config["LISTEN_LIST"][0][1] if isinstance(config["LISTEN_LIST"][0], list) \
+        else config["LISTEN_LIST"][1]
+    base_url = f"http://127.0.0.1:{port}"
+    config.update({
+        "TRANSPORT": "fake",
+        "LISTEN_LIST": [{"chat": f"bench-{i}", "prompt": prompt_name} for i in range(args.chats)],
+        "FAKE_MESSAGE_RATE": args.rate,
+        "FAKE_DURATION": args.duration,
+        "FAKE_REPLAY_FILE": args.replay,
+        "FAKE_FAILURE_RATE": args.failure_rate,
+        "DEEPSEEK_BASE_URL": base_url,
+        "DEEPSEEK_API_KEY": "mock",
+        "MOONSHOT_BASE_URL": base_url,
+        "MOONSHOT_API_KEY": "mock",
+        "WAITING_TIME": args.waiting,
+        "STREAM_SWITCH": args.stream,
+        "AVERAGE_TYPING_SPEED": 0,
+        "RANDOM_TYPING_SPEED_MIN": 0,
+        "RANDOM_TYPING_SPEED_MAX": 0,
+        "MEMORY_SWITCH": False,
+        "MEMORY_RECALL_SWITCH": False,
+        "STATE_SWITCH": False,
+        "MEDIA_CACHE_SWITCH": False,
+        "MCP_SWITCH": False,
+        "METRICS_SWITCH": False,
+        "PROFILER_SWITCH": False,
+        "SEND_RATE_PER_MINUTE": 100000,
+        "RATE_LIMITS": {"default": {"rpm": 100000, "tpm": 100000000}},
+    })
+    fd, path = tempfile.mkstemp(prefix="bench_e2e_", suffix=".yaml")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=6, help="每个聊天每分钟消息数")
+    parser.add_argument("--duration", type=float, default=30, help="生成消息的时长（秒）")
+    parser.add_argument("--drain", type=float, default=30, help="生成结束后最多等待回复的时间（秒）")
+    parser.add_argument("--waiting", type=float, default=1, help="防抖等待时间 WAITING_TIME")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟接口首字节延迟")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--replay", default="", help="回放录制的消息（jsonl）")
+    parser.add_argument("--failure-rate", type=float, default=0, help="每次拉取模拟通道故障的概率")
+    args = parser.parse_args()
+
+    options = MockOptions(latency=args.latency, jitter=args.jitter)
+    port = start_mock(options)
+    os.environ["WXBOT_CONFIG"] = write_config(args, port)
+
+    tracemalloc.start()
+    import main as bot  # noqa: E402
+    bot.bootstrap()  # 按 WXBOT_CONFIG 初始化
+    bot.wait_subscriptions()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    start = time.monotonic()
+    threading.Thread(target=bot.message_listener, daemon=True).start()
+    bot.start_sender()
+
+    deadline = start + args.duration + args.drain
+    time.sleep(args.duration)
+    while time.monotonic() < deadline and not bot.transport.finished():
+        time.sleep(0.5)
+    elapsed = time.monotonic() - start
+
+    current, peak = tracemalloc.get_traced_memory()
+    stats = bot.transport.get_stats()
+    latencies = stats.pop("latencies")
+    print(f"聊天数: {args.chats}, 每聊天 {args.rate} 条/分钟, 生成 {args.duration}s, "
+          f"{'流式' if args.stream else '非流式'}, 模拟接口延迟 {args.latency}s")
+    print(f"消息: 收到 {stats['received']}, 发送 {stats['sent']}, 已回复轮次 {stats['replied']}, "
+          f"未回复聊天 {stats['unanswered']}")
+    print(f"回复延迟: p50={percentile(latencies, 50):.3f}s p95={percentile(latencies, 95):.3f}s "
+          f"p99={percentile(latencies, 99):.3f}s (含防抖 {args.waiting}s)")
+    print(f"吞吐: {stats['replied'] / elapsed:.2f} 轮/s, {stats['received'] / elapsed:.2f} 条/s, 接口请求 "
+          f"{options.stats['requests']}")
+    print(f"内存: 每聊天 {(current - baseline) / args.chats / 1024:.1f} KiB, "
+          f"峰值增量 {(peak - baseline) / 1024 / 1024:.1f} MiB")
+    if args.failure_rate:
+        print(f"通道故障: {stats['failures']} 次, 丢失消息 {stats['lost']}, 恢复统计 {bot.supervisor.stats}")
+    for stage, values in sorted(bot.metrics.stage_quantiles().items()):
+        print(f"  {stage:<18} p50={values[0.5]:.3f}s p95={values[0.95]:.3f}s p99={values[0.99]:.3f}s")
+    bot.stop_sender()
+    os.remove(os.environ["WXBOT_CONFIG"])
+
+
+if __name__ == "__main__":
+    main()
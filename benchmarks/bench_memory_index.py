@@ -0,0 +1,77 @@
+"""
+长期记忆检索基准：生成模拟聊天日志，测量 MemoryIndex 的写入吞吐和查询延迟
+用法: python benchmarks/bench_memory_index.py [--users 20] [--lines 5000] [--queries 500]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model.MemoryIndex import MemoryIndex  # noqa: E402
+
+WORDS = ["今天", "电影", "晚饭", "考试", "作业", "周末", "旅游", "音乐", "天气", "图书馆", "火锅", "奶茶",
+         "跑步", "游戏", "宿舍", "老师", "论文", "生日", "礼物", "咖啡", "python", "deepseek"]
+
+
+def make_line(now, role):
+    content = "".join(random.choice(WORDS) for _ in range(random.randint(3, 12)))
+    return f"{now.strftime('%Y-%m-%d %H:%M:%S')} | [{role}] {content}\n"
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=5000, help="每个用户的日志行数")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    memory_dir = tempfile.mkdtemp(prefix="bench_memory_")
+    start = datetime(2025, 1, 1)
+    for u in range(args.users):
+        for kind, role in (("User", "User"), ("AI", "AI")):
+            with open(os.path.join(memory_dir, f"user{u}_prompt_{kind}_log.txt"), "w", encoding="utf-8") as f:
+                for i in range(args.lines // 2):
+                    f.write(make_line(start + timedelta(seconds=i * 30), role))
+
+    config = {"MEMORY_TOP_K": 5, "MEMORY_TOKEN_BUDGET": 400, "MEMORY_REFRESH_INTERVAL": 0}
+    index = MemoryIndex(logging.getLogger("bench"), config, memory_dir)
+
+    t0 = time.perf_counter()
+    added = index.refresh(force=True)
+    ingest = time.perf_counter() - t0
+    print(f"全量写入: {added} 行, {ingest:.3f}s, {added / ingest:,.0f} 行/秒")
+
+    # 增量写入：每个用户追加 100 行
+    for u in range(args.users):
+        with open(os.path.join(memory_dir, f"user{u}_prompt_User_log.txt"), "a", encoding="utf-8") as f:
+            for i in range(100):
+                f.write(make_line(datetime.now(), "User"))
+    t0 = time.perf_counter()
+    added = index.refresh(force=True)
+    print(f"增量写入: {added} 行, {(time.perf_counter() - t0) * 1000:.1f}ms")
+
+    latencies = []
+    for _ in range(args.queries):
+        owner = f"user{random.randrange(args.users)}_prompt"
+        query = "".join(random.choice(WORDS) for _ in range(4))
+        t0 = time.perf_counter()
+        index.search(owner, query)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    print(f"查询延迟: p50={percentile(latencies, 50):.2f}ms p95={percentile(latencies, 95):.2f}ms "
+          f"p99={percentile(latencies, 99):.2f}ms")
+    print(f"索引规模: {index.get_stats()}")
+
+
+if __name__ == "__main__":
+    main()
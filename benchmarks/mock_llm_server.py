@@ -0,0 +1,102 @@
+"""
+本地 OpenAI 兼容的模拟接口（/chat/completions），用于离线压测
+可调首字节延迟、抖动、流式分块间隔、错误率和限流率
+用法: python benchmarks/mock_llm_server.py [--port 8900] [--latency 0.5] [--jitter 0.2] [--chunk-delay 0.05]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+DEFAULT_REPLY = "好的，我明白你的意思了。我们一步一步来看这个问题吧。"
+
+
+class MockOptions:
+    def __init__(self, latency=0.5, jitter=0.2, chunk_delay=0.05, chunk_size=4, reply=DEFAULT_REPLY,
+                 error_rate=0.0, rate_limit_rate=0.0):
+        self.latency = latency  # 首字节延迟（秒）
+        self.jitter = jitter  # 延迟随机增加 0~jitter 秒
+        self.chunk_delay = chunk_delay  # 流式分块间隔（秒）
+        self.chunk_size = chunk_size  # 每个分块的字数
+        self.reply = reply
+        self.error_rate = error_rate  # 返回 500 的比例
+        self.rate_limit_rate = rate_limit_rate  # 返回 429 的比例
+        self.stats = {"requests": 0, "stream": 0, "errors": 0, "rate_limited": 0}
+
+
+def make_app(options):
+    async def chat_completions(request):
+        body = await request.json()
+        options.stats["requests"] += 1
+        await asyncio.sleep(options.latency + random.uniform(0, options.jitter))
+
+        roll = random.random()
+        if roll < options.rate_limit_rate:
+            options.stats["rate_limited"] += 1
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": "1"})
+        if roll < options.rate_limit_rate + options.error_rate:
+            options.stats["errors"] += 1
+            return web.json_response({"error": "mock error"}, status=500)
+
+        model = body.get("model", "mock")
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"mock-{time.time_ns()}",
+                "object": "chat.completion",
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": options.reply}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(options.reply)},
+            })
+
+        options.stats["stream"] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(options.reply), options.chunk_size):
+            chunk = {"choices": [{"index": 0, "delta": {"content": options.reply[i:i + options.chunk_size]}}],
+                     "model": model}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await asyncio.sleep(options.chunk_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", chat_completions)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+async def start_server(options, host="127.0.0.1", port=0):
+    """在当前事件循环中启动，返回 (runner, 实际端口)"""
+    runner = web.AppRunner(make_app(options))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.05)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    options = MockOptions(latency=args.latency, jitter=args.jitter, chunk_delay=args.chunk_delay,
+                          chunk_size=args.chunk_size, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate)
+    print(f"模拟接口: http://{args.host}:{args.port}")
+    web.run_app(make_app(options), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
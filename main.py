@@ -1,21 +1,36 @@
+import argparse
+import importlib
 import logging
 import os
 import re
 import shutil
+import subprocess
+import sys
 import threading
 import time
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
+from collections import deque
+from contextlib import contextmanager
 
-import pyautogui
 import yaml
-from wxauto import WeChat
-from model.User import User
+from model.Transport import TransportError, create_transport
+from model.UserRegistry import UserRegistry
 from model.Ai import Ai
-
-with open("config.yaml", "r", encoding="utf-8") as f:
-    config = yaml.safe_load(f)
+from model.Scheduler import Scheduler
+from model.Debouncer import Debouncer
+from model.VisionPipeline import VisionJob, VisionPipeline
+from model.MediaCache import MediaCache
+from model.LogWriter import LogWriter
+from model.MemoryIndex import MemoryIndex
+from model.StateStore import StateStore
+from model.Dispatcher import Dispatcher
+from model.ListenerSupervisor import ListenerSupervisor
+from model.RateLimiter import RateLimiter
+from model.Metrics import Metrics
+from model.Profiler import SamplingProfiler
+from model.WorkerPool import RemoteDispatcher, WorkerPool, shard_of
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,185 +42,405 @@ root_dir = os.path.dirname(os.path.abspath(__file__))
 
 queue_lock = threading.Lock()
 
-memory_dir = os.path.join(root_dir, "temp", "memory")
-if not os.path.exists(memory_dir):
-    os.makedirs(memory_dir)
-    logger.info(f"创建内存目录: {memory_dir}")
-
-# 修改配置文件中的内存目录路径
-config["MEMORY_TEMP_DIR"] = memory_dir
-
-wx = WeChat()
-
-emoji_timer = None
-emoji_timer_lock = threading.Lock()
+# 以下组件在 bootstrap() 中按配置创建：导入本模块不读取配置、不创建目录、不连接微信
+config = None
+# 拆分模式下：前端进程(front)只操作微信，工作进程(worker)持有用户状态并调用接口
+ROLE = "front"
+owns_users = True
+worker_pool = None  # 拆分模式下由前端进程在 main() 中启动
+worker_shard = None  # 工作进程负责的分片 (序号, 进程数)
+transport = None
+dispatcher = None
+
+llm_semaphore = None  # 在发送线程的事件循环中创建
+mcp_pool = None  # 开启 MCP_SWITCH 时在发送线程的事件循环中连接
+background_tasks = set()
+debounce_scheduler = Scheduler()  # 按 last_message_time + WAITING_TIME 排序的防抖调度
+proactive_scheduler = Scheduler()  # 按 user_timers + user_wait_time 排序的主动消息调度
+
+emoji_debouncer = Debouncer(logger=logger, name="emoji-debouncer")  # 按聊天分别合并连续的表情包
+
+log_writer = None
+state_store = None
+users = None
+ai = None
+media_cache = None
+memory_index = None
+vision_pipeline = None
+metrics = Metrics(logger=logger)  # 各阶段耗时按聊天记录，开启 METRICS_SWITCH 时导出
+supervisor = None
+sender_loop = None  # 消息处理线程的事件循环，由 start_sender 创建
+sender_task = None
+sender_thread = None
+replay_buffer = deque()  # 已拉取但还未处理的消息
+subscriptions = []  # 连接微信和添加监听的 Future，在 UI 调度线程中执行
+startup_timings = []  # (步骤, 秒)，--profile-startup 时打印
+
+
+def load_config():
+    # 压测和回放时可以通过环境变量指定其他配置文件
+    with open(os.environ.get("WXBOT_CONFIG", "config.yaml"), "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+@contextmanager
+def startup_step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings.append((name, time.perf_counter() - start))
 
-user_list = [User(name=config["LISTEN_LIST"][0], prompt_name=config["LISTEN_LIST"][1], logger=logger, config=config)]
-for user in user_list:
-    wx.AddListenChat(who=user.name, savepic=True)
 
-ai = Ai(logger=logger, config=config)
+def bootstrap(role="front"):
+    """
+    读取配置并创建各组件
+    连接微信和逐个添加监听交给 UI 调度线程排队执行，与其余初始化同时进行，由 wait_subscriptions 等待完成
+    """
+    global config, ROLE, owns_users, transport, dispatcher, log_writer, state_store, users, ai, media_cache, \
+        memory_index, vision_pipeline, supervisor, replay_buffer
+    with startup_step("读取配置"):
+        config = load_config()
+        memory_dir = os.path.join(root_dir, "temp", "memory")
+        if not os.path.exists(memory_dir):
+            os.makedirs(memory_dir)
+            logger.info(f"创建内存目录: {memory_dir}")
+
+        # 修改配置文件中的内存目录路径
+        config["MEMORY_TEMP_DIR"] = memory_dir
+    ROLE = role
+    owns_users = role == "worker" or not config["SPLIT_MODE"]
+
+    with startup_step("用户注册表"):
+        log_writer = LogWriter(logger=logger, config=config)
+        state_store = StateStore(logger=logger, config=config, db_path=os.path.join(root_dir, "temp", "state.db")) \
+            if config["STATE_SWITCH"] and owns_users else None
+        users = UserRegistry(config["LISTEN_LIST"], logger=logger, config=config, log_writer=log_writer,
+                             state_store=state_store)
+
+    if role == "worker":
+        dispatcher = RemoteDispatcher(logger=logger)  # 发送交给前端进程
+    else:
+        with startup_step("创建聊天通道"):
+            transport = create_transport(logger=logger, config=config)  # 微信客户端或离线回放通道
+            # 所有UI自动化调用（发送、截图、拉取消息）都由这一个线程串行执行，连接也在这个线程中建立
+            dispatcher = Dispatcher(logger=logger, config=config, send_fn=transport.send)
+            subscriptions.append(dispatcher.call(transport.connect))
+            subscriptions.extend(dispatcher.call(transport.add_listen_chat, name) for name in users.names())
+            supervisor = ListenerSupervisor(logger=logger, config=config, transport=transport,
+                                            dispatcher=dispatcher, metrics=metrics)
+
+    with startup_step("接口客户端"):
+        ai = Ai(logger=logger, config=config)
+    with startup_step("图片识别缓存"):
+        media_cache = MediaCache(logger=logger, config=config,
+                                 db_path=os.path.join(root_dir, "temp", "media_cache.db")) \
+            if config["MEDIA_CACHE_SWITCH"] and owns_users else None
+    with startup_step("记忆索引"):
+        memory_index = MemoryIndex(logger=logger, config=config, memory_dir=memory_dir) \
+            if config["MEMORY_RECALL_SWITCH"] and owns_users else None
+    vision_pipeline = VisionPipeline(ai, logger=logger, config=config, on_done=lambda job: on_vision_done(job),
+                                     cache=media_cache)
+    replay_buffer = deque(maxlen=config["LISTENER_REPLAY_SIZE"])
+
+
+def wait_subscriptions():
+    """等待连接和添加监听完成；失败时交给监听线程按退避重试，只补订阅缺失的聊天"""
+    with startup_step(f"连接微信并添加监听(剩余等待, {len(subscriptions) - 1}个聊天)"):
+        for future in subscriptions:
+            try:
+                future.result()
+            except Exception as e:
+                supervisor.fail(e)
+                break
+    subscriptions.clear()
+
+
+def print_startup_profile():
+    """--profile-startup：导入耗时（python -X importtime）、各初始化步骤耗时、首次使用时才导入的依赖"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=root_dir,
+                            capture_output=True, text=True)
+    imports, total = [], 0
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name, seconds = parts[2].strip(), int(parts[1]) / 1e6
+        depth = (len(parts[2]) - len(parts[2].lstrip())) // 2
+        # 子模块先于父模块输出：遇到顶层模块时，之前收集的一级模块就是它直接导入的
+        if depth == 0:
+            if name == "main":
+                total = seconds
+                break
+            imports = []
+        elif depth == 1:
+            imports.append((name, seconds))
+    print(f"导入 main.py: {total * 1000:.1f} ms，最慢的直接导入：")
+    for name, seconds in sorted(imports, key=lambda x: -x[1])[:10]:
+        print(f"  {name:<32}{seconds * 1000:>9.1f} ms")
+
+    print("初始化：")
+    for name, seconds in startup_timings:
+        print(f"  {name:<32}{seconds * 1000:>9.1f} ms")
+
+    print("首次使用时才导入：")
+    lazy = ["aiohttp", "PIL"] + (["wxauto", "pyautogui"] if config["TRANSPORT"] == "wx" else []) + \
+        (["openai", "mcp"] if config["MCP_SWITCH"] else [])
+    for name in lazy:
+        if name in sys.modules:
+            print(f"  {name:<32}{'已导入':>9}")
+            continue
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            print(f"  {name:<32}{(time.perf_counter() - start) * 1000:>9.1f} ms")
+        except ImportError:
+            print(f"  {name:<32}{'未安装':>9}")
 
 
-###################################### 消息监听 存入'/tmp/memory'中 消息在user.user_queues中 ######################################
+###################################### 消息监听 存入'/tmp/memory'中 消息在user.inbox中 ######################################
 def message_listener():
-    global wx
     logger.info("开始监听消息...")
     while True:
+        if not supervisor.recover(users.names()):
+            time.sleep(supervisor.wait())
+            continue
         try:
-            if wx is None:
-                logger.info("尝试重新连接微信...")
-                wx = WeChat()
-                logger.info("微信连接成功")
-
-                for user in user_list:
-                    wx.AddListenChat(who=user.name, savepic=True)
-                logger.info("成功添加监听")
-
-            msgs = wx.GetListenMessage()
-            if msgs:
-                logger.info(f"收到新消息: {msgs}")
-            for chat in msgs:
-                who = chat.who
-                one_msgs = msgs.get(chat)
-                logger.info(f"处理来自 {who} 的消息: {one_msgs}")
-                print(f"【{who}】：{one_msgs}")
-                for msg in one_msgs:
-                    msg_type = msg.type
-                    content = msg.content
-                    logger.info(f'【{who}】：{content}')
-                    if not content:
-                        continue
-                    if msg_type != 'friend':
-                        logger.debug(f"非好友消息，忽略! 消息类型: {msg_type}")
-                        continue
-                    if who == msg.sender:
-                        if '[动画表情]' in content and config["SEND_EMOJI_SWITCH"]:
-                            handle_emoji_message(msg, who)
-                        else:
-                            handle_wx_message(msg, who)
-                    else:
-                        logger.debug(f"非需要处理消息: {content}")
-
+            with metrics.span("poll"):
+                msgs = dispatcher.run(transport.get_listen_messages)
         except Exception as e:
-            logger.error(f"Message: {str(e)}")
-            wx = None
+            supervisor.fail(e)  # 拉取失败视为通道故障，单条消息的错误不会走到这里
+            continue
+        if msgs:
+            logger.info(f"收到新消息: {msgs}")
+        for who, one_msgs in msgs.items():
+            logger.info(f"处理来自 {who} 的消息: {one_msgs}")
+            print(f"【{who}】：{one_msgs}")
+            buffer_replay([(who, msg) for msg in one_msgs])
+        drain_replay_buffer()
         time.sleep(1)
 
 
-def handle_emoji_message(msg, who):
-    global emoji_timer
-    name = who
-    user = [user for user in user_list if user.name == name][0]
-    user.can_send_messages = False
-
-    def timer_callback():
-        global emoji_timer
-        with emoji_timer_lock:
+def buffer_replay(items):
+    """把消息放入重放缓冲区；缓冲区满时最早的消息被挤掉，记录丢弃条数"""
+    limit = replay_buffer.maxlen
+    dropped = max(0, len(replay_buffer) + len(items) - limit) if limit is not None else 0
+    if dropped:
+        logger.warning(f"重放缓冲区已满（{limit}条），丢弃最早的 {dropped} 条消息")
+        metrics.inc("wxbot_listener_replay_dropped_total", dropped)
+    replay_buffer.extend(items)
+
+
+def drain_replay_buffer():
+    """按到达顺序处理拉取到的消息；通道故障时剩下的消息留在缓冲区，恢复后重放"""
+    while replay_buffer:
+        who, msg = replay_buffer[0]
+        try:
+            handle_listened_message(msg, who)
+        except TransportError as e:
+            supervisor.fail(e)
+            return
+        except Exception as e:
+            logger.error(f"消息处理失败，跳过: {str(e)}")
+            metrics.inc("wxbot_listener_message_errors_total")
+        replay_buffer.popleft()
+
+
+def handle_listened_message(msg, who):
+    msg_type = msg.type
+    content = msg.content
+    logger.info(f'【{who}】：{content}')
+    if not content:
+        return
+    if msg_type != 'friend':
+        logger.debug(f"非好友消息，忽略! 消息类型: {msg_type}")
+        return
+    if who == msg.sender:
+        if '[动画表情]' in content and config["SEND_EMOJI_SWITCH"]:
+            handle_emoji_message(msg, who)
+        else:
             handle_wx_message(msg, who)
-            emoji_timer = None
+    else:
+        logger.debug(f"非需要处理消息: {content}")
+
 
-    with emoji_timer_lock:
-        if emoji_timer is not None:
-            emoji_timer.cancel()
-        emoji_timer = threading.Timer(3.0, timer_callback)
-        emoji_timer.start()
+def handle_emoji_message(msg, who):
+    if who not in users:
+        return
+    deliver_event({"type": "hold", "chat": who})  # 等待合并期间暂不回复
+
+    # 同一聊天连续发送表情包时只处理最后一个，不同聊天互不影响
+    emoji_debouncer.call_later(who, config["EMOJI_DEBOUNCE_TIME"], lambda: handle_debounced_emoji(msg, who))
+
+
+def handle_debounced_emoji(msg, who):
+    try:
+        handle_wx_message(msg, who)
+    except TransportError as e:
+        buffer_replay([(who, msg)])  # 截图时通道故障，恢复后重新处理
+        supervisor.fail(e)
+    finally:
+        # 在表情包事件之后送达，拆分模式下工作进程也据此解除等待
+        deliver_event({"type": "release", "chat": who})
 
 
 def handle_wx_message(msg, who):
+    """UI 侧：把消息整理成事件（表情包在这里截图），交给持有用户状态的一方处理"""
     try:
-        name = who
-        user = [user for user in user_list if user.name == name][0]
-        content = getattr(msg, 'content', None) or getattr(msg, 'text', None)
-        img_path = None
-        is_emoji = False
+        if who not in users:
+            logger.debug(f"不在监听列表中的聊天，忽略: {who}")
+            return
+        deliver_event(normalize_message(msg, who))
+    except TransportError:
+        raise
+    except Exception as e:
+        logger.error(f"消息处理失败: {str(e)}")
 
-        user.make_user_auto_time()
 
-        if content and content.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-            if config["HANDLE_IMAGE_SWITCH"]:
-                img_path = content
-                is_emoji = False
-                content = None
-            else:
-                content = "[图片]"
-
-        if content and "[动画表情]" in content:
-            if config["HANDLE_EMOJI_SWITCH"]:
-                img_path = screenshot_save(name)
-                is_emoji = True
-                content = None
-            else:
-                content = "[动画表情]"
-                clean_temp_files()
+def normalize_message(msg, who):
+    content = getattr(msg, 'content', None) or getattr(msg, 'text', None)
+    img_path = None
+    is_emoji = False
+
+    if content and content.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
+        if config["HANDLE_IMAGE_SWITCH"]:
+            img_path = content
+            is_emoji = False
+            content = None
+        else:
+            content = "[图片]"
+
+    if content and "[动画表情]" in content:
+        if config["HANDLE_EMOJI_SWITCH"]:
+            img_path = screenshot_save(who)
+            is_emoji = True
+            content = None
+        else:
+            content = "[动画表情]"
+
+    return {"type": "message", "chat": who, "content": content, "img_path": img_path, "is_emoji": is_emoji,
+            "time": time.time()}
+
+
+def deliver_event(event):
+    """单进程模式直接处理，拆分模式按聊天分片发给工作进程"""
+    if worker_pool is not None:
+        worker_pool.route(event)
+    else:
+        accept_event(event)
+
+
+def accept_event(event):
+    """持有用户状态的一方：把事件加入用户队列"""
+    try:
+        name = event["chat"]
+        user = users.get(name)
+        if user is None:
+            return
+        if event["type"] == "hold":
+            with user.queue_lock:
+                user.emoji_hold = True
+                user.can_send_messages = False
+            return
+        if event["type"] == "release":
+            with user.queue_lock:
+                user.emoji_hold = False
+            refresh_can_send(user)
+            return
+        content = event["content"]
+        img_path = event["img_path"]
+
+        user.make_user_auto_time()
+        user.proactive_sent = 0
+        schedule_proactive(user)
 
         if img_path:
+            # 识别在事件循环中异步进行，监听线程不等待网络请求；占位任务保证消息按到达顺序拼回
             user.logger.info(f"处理图片消息 - {name}: {img_path}")
-            user.can_send_messages = False
-            recognized_text = ai.moonshot_image(img_path, is_emoji=is_emoji, user=user)
-            content = recognized_text if content is None else f"{content} {recognized_text}"
-            clean_temp_files()
+            with user.queue_lock:
+                user.pending_media += 1
+                user.can_send_messages = False
+            job = VisionJob(user, img_path, is_emoji=event["is_emoji"])
+            enqueue_user_message(user, job)
+            vision_pipeline.submit(job)
+            return
 
         if content:
             if config["MEMORY_SWITCH"]:
                 user.make_log_user(content)
 
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            current_time = datetime.fromtimestamp(event["time"]).strftime("%Y-%m-%d %H:%M:%S")
             content = f"[{current_time}] {content}"
             logger.info(f"处理消息 - {name}: {content}")
-            sender_name = name
-
-            with user.queue_lock:  # 使用用户级别的锁
-                if not user.user_queues:
-                    user.user_queues = {
-                        'messages': [content],
-                        'name': name,
-                        'last_message_time': time.time()
-                    }
-                    logger.info(f"已为 {sender_name} 初始化消息队列")
-                else:
-                    if len(user.user_queues['messages']) >= 5:
-                        user.user_queues['messages'].pop(0)
-                    user.user_queues['messages'].append(content)
-                    user.user_queues['last_message_time'] = time.time()
-
-                    logger.info(f"{sender_name} 的消息已加入队列并更新最后消息时间")
+            enqueue_user_message(user, content)
+            refresh_can_send(user)
         else:
             logger.warning("无法获取消息内容")
+            refresh_can_send(user)
     except Exception as e:
         logger.error(f"消息处理失败: {str(e)}")
 
 
+def enqueue_user_message(user, item):
+    """将文本或图片识别任务加入用户队列，并推迟该用户的防抖截止时间"""
+    name = user.name
+    with user.queue_lock:  # 使用用户级别的锁
+        if user.inbox.push(item):
+            logger.info(f"{name} 的待回复消息已满 {user.inbox.capacity} 条，已合并较早的消息")
+        else:
+            logger.info(f"{name} 的消息已加入队列并更新最后消息时间")
+        deadline = user.inbox.last_time + config['WAITING_TIME']
+    debounce_scheduler.schedule(name, deadline)
+    save_state(user)
+
+
+def save_state(user):
+    """标记用户状态已变化，由后台线程定期写入快照"""
+    if state_store is not None:
+        state_store.mark_dirty(user)
+
+
+def refresh_can_send(user):
+    """没有识别中的图片、也没有等待合并的表情包时才允许回复"""
+    with user.queue_lock:
+        user.can_send_messages = user.pending_media == 0 and not user.emoji_hold
+
+
+def on_vision_done(job):
+    """图片识别完成（在发送线程的事件循环中回调）"""
+    user = job.user
+    if job.started is not None:
+        metrics.stage("vision_queue", job.started - job.queued, user.name)
+        metrics.stage("vision", job.finished - job.started, user.name)
+    if job.text and config["MEMORY_SWITCH"]:
+        user.make_log_user(job.text)
+    with user.queue_lock:
+        user.pending_media -= 1
+    refresh_can_send(user)
+    remove_temp_file(job.img_path)
+    reschedule_pending(user)
+
+
 def screenshot_save(name):
+    """截图会切换和激活窗口，交给UI调度线程执行，避免与发送消息争抢焦点"""
+    return dispatcher.run(capture_chat_window, name, chat=name)
+
+
+def capture_chat_window(name):
     screenshot_folder = os.path.join(root_dir, 'screenshot')
     if not os.path.exists(screenshot_folder):
         os.makedirs(screenshot_folder)
     screenshot_path = os.path.join(screenshot_folder, f'{name}_{datetime.now().strftime("%Y%m%d%H%M%S")}.png')
+    return transport.screenshot(name, screenshot_path)
 
-    try:
-        # 激活并定位微信聊天窗口
-        wx_chat = WeChat()
-        wx_chat.ChatWith(name)
-        chat_window = pyautogui.getWindowsWithTitle(name)[0]
-
-        # 确保窗口被前置和激活
-        if not chat_window.isActive:
-            chat_window.activate()
-        if not chat_window.isMaximized:
-            chat_window.maximize()
-
-        # 获取窗口的坐标和大小
-        x, y, width, height = chat_window.left, chat_window.top, chat_window.width, chat_window.height
-
-        time.sleep(1)
 
-        # 截取指定窗口区域的屏幕
-        screenshot = pyautogui.screenshot(region=(x, y, width, height))
-        screenshot.save(screenshot_path)
-        logger.info(f'已保存截图: {screenshot_path}')
-        return screenshot_path
-    except Exception as e:
-        logger.error(f'保存截图失败: {str(e)}')
+def remove_temp_file(path):
+    """只删除本次识别用过的临时图片，避免误删其他仍在识别中的文件"""
+    try:
+        if path and os.path.isfile(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"删除临时文件失败: {path}, {str(e)}")
 
 
 def clean_temp_files():
@@ -243,23 +478,133 @@ def remove_timestamps(text):
 
 async def process_user_messages(user):
     with user.queue_lock:  # 使用用户级别的锁
-        if not user.user_queues:
+        if not user.inbox:
             return
-        messages = user.user_queues['messages']
-        user.user_queues = {}
-
-    merged_message = ' '.join(messages)
+        first_message_time = user.inbox.first_time
+        messages = user.inbox.drain()
+    metrics.stage("debounce", time.time() - first_message_time, user.name)
+
+    # 图片识别任务替换为识别结果，识别失败的直接丢弃
+    messages = [item.render() if isinstance(item, VisionJob) else item for item in messages]
+    merged_message = ' '.join(message for message in messages if message)
+    if not merged_message:
+        return
     logger.info(f"处理合并消息 ({user.name}): {merged_message}")
 
-    reply = await ai.get_deepseek_response(merged_message, user)
-    
-    if "</think>" in reply:
-        reply = reply.split("</think>", 1)[1].strip()
+    memory = None
+    if memory_index is not None:
+        # 已在上下文中的不再重复检索；本批消息在防抖期间已写入日志，也要排除
+        exclude = [message["content"] for message, _ in user.context.turns] + [merged_message]
+        memory = await asyncio.to_thread(memory_index.recall, user, merged_message, exclude)
+
+    if config["STREAM_SWITCH"] and mcp_pool is None:
+        await process_streaming_reply(user, merged_message, memory)
+    else:
+        async with llm_semaphore:  # 全局限制同时进行的LLM调用数
+            with metrics.span("llm", user.name):
+                if mcp_pool is not None:
+                    reply = await ai.get_mcp_response(merged_message, user, mcp_pool, memory=memory)
+                else:
+                    reply = await ai.get_deepseek_response(merged_message, user, memory=memory)
+
+        if "</think>" in reply:
+            reply = reply.split("</think>", 1)[1].strip()
+
+        if "## 记忆片段" not in reply:
+            await send_reply(user, reply)
+
+    metrics.stage("reply", time.time() - first_message_time, user.name)  # 第一条消息到回复发完
+    save_state(user)
+    if user.context.needs_compaction():
+        spawn(compact_user_context(user))
+
+
+def spawn(coro):
+    """创建后台任务并保留引用，防止任务在完成前被回收"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def compact_user_context(user):
+    """同一用户同时只压缩一次，压缩期间新移出的对话在本次结束后接着压缩"""
+    if user.context.compacting:
+        return
+    user.context.compacting = True
+    try:
+        while user.context.needs_compaction():
+            async with llm_semaphore:
+                await ai.compact_context(user)
+    finally:
+        user.context.compacting = False
+    save_state(user)
+
+async def process_streaming_reply(user, merged_message, memory=None):
+    """
+    流式模式：生成与发送并行，分段一完整就进入发送队列
+    生成结束即释放并发名额，打字延迟不占用LLM调用数
+    """
+    segments = asyncio.Queue()
+
+    async def produce():
+        try:
+            async with llm_semaphore:
+                start = time.monotonic()
+                first = True
+                async for segment in ai.stream_deepseek_response(merged_message, user, memory=memory):
+                    if first:
+                        metrics.stage("llm_first_segment", time.monotonic() - start, user.name)
+                        first = False
+                    await segments.put(segment)
+                metrics.stage("llm", time.monotonic() - start, user.name)
+        finally:
+            await segments.put(None)
+
+    producer = asyncio.create_task(produce())
+    await send_reply_stream(user, segments)
+    await producer
+
+
+def typing_delay(text):
+    """模拟打字耗时：按下一段的字数计算，至少2秒"""
+    delay = len(text) * (
+        config['AVERAGE_TYPING_SPEED'] +
+        random.uniform(config['RANDOM_TYPING_SPEED_MIN'],
+                       config['RANDOM_TYPING_SPEED_MAX'])
+    )
+    return max(delay, 2)
+
+
+async def send_reply_stream(user, segments):
+    """依次发送队列中的分段，打字延迟从上一段发出时开始计算，与生成时间重叠"""
+    try:
+        user.is_sending_message = True
+        last_sent = None
+        while True:
+            part = await segments.get()
+            if part is None:
+                break
+            part = remove_timestamps(part)
+            if not part:
+                continue
+            if last_sent is not None:
+                delay = typing_delay(part) - (time.monotonic() - last_sent)
+                if delay > 0:
+                    with metrics.span("typing", user.name):
+                        await asyncio.sleep(delay)
+            with metrics.span("send", user.name):
+                await asyncio.wrap_future(dispatcher.send(user.name, part))
+            last_sent = time.monotonic()
+            logger.info(f"分段回复 {user.name}: {part}")
+            user.make_log_reply(part)
+    except Exception as e:
+        logger.error(f"发送回复失败: {str(e)}")
+    finally:
+        user.is_sending_message = False
 
-    if "## 记忆片段" not in reply:
-        await send_reply(user, reply)
 
-async def send_reply(user, reply):
+async def send_reply(user, reply, priority=Dispatcher.PRIORITY_INTERACTIVE):
     try:
         user.is_sending_message = True
         reply = remove_timestamps(reply)
@@ -267,22 +612,17 @@ async def send_reply(user, reply):
         if '\\' in reply:
             parts = [p.strip() for p in reply.split('\\') if p.strip()]
             for i, part in enumerate(parts):
-                wx.SendMsg(part, user.name)
+                with metrics.span("send", user.name):
+                    await asyncio.wrap_future(dispatcher.send(user.name, part, priority))
                 logger.info(f"分段回复 {user.name}: {part}")
                 user.make_log_reply(part)
 
                 if i < len(parts) - 1:
-                    next_part = parts[i + 1]
-                    delay = len(next_part) * (
-                        config['AVERAGE_TYPING_SPEED'] + 
-                        random.uniform(config['RANDOM_TYPING_SPEED_MIN'],
-                                    config['RANDOM_TYPING_SPEED_MAX'])
-                    )
-                    if delay < 2:
-                        delay = 2
-                    await asyncio.sleep(delay)
+                    with metrics.span("typing", user.name):
+                        await asyncio.sleep(typing_delay(parts[i + 1]))
         else:
-            wx.SendMsg(reply, user.name)
+            with metrics.span("send", user.name):
+                await asyncio.wrap_future(dispatcher.send(user.name, reply, priority))
             logger.info(f"回复 {user.name}: {reply}")
             user.make_log_reply(reply)
 
@@ -292,47 +632,319 @@ async def send_reply(user, reply):
         logger.error(f"发送回复失败: {str(e)}")
         user.is_sending_message = False
 
+def reschedule_pending(user, delay=0):
+    """流水线结束或暂不可发送时，为仍有待处理消息的用户重新排期"""
+    with user.queue_lock:
+        if not user.inbox:
+            return
+        deadline = max(user.inbox.last_time + config['WAITING_TIME'], time.time() + delay)
+    debounce_scheduler.schedule(user.name, deadline)
+
+
+def schedule_proactive(user):
+    """用户发言或收到主动消息后重排下一次主动消息时间，达到上限后等用户再次发言"""
+    if not config["ENABLE_AUTO_MESSAGE"]:
+        return
+    if user.proactive_sent >= config["AUTO_MESSAGE_MAX_REPEAT"]:
+        proactive_scheduler.cancel(user.name)
+        return
+    proactive_scheduler.schedule(user.name, user.user_timers + user.user_wait_time)
+
+
+def quiet_hours_end(now):
+    """处于免打扰时段时返回时段结束的时间戳，否则返回 None"""
+    start, end = config["QUIET_HOURS"]
+    if start == end:
+        return None
+    if start < end:
+        quiet = start <= now.hour < end
+    else:
+        quiet = now.hour >= start or now.hour < end
+    if not quiet:
+        return None
+    resume = now.replace(hour=end, minute=0, second=0, microsecond=0)
+    if resume <= now:
+        resume += timedelta(days=1)
+    return resume.timestamp()
+
+
+def seed_proactive():
+    """
+    启动时为所有聊天排期主动消息：有快照的按保存的计时，没有的从现在开始计时；
+    只读取快照中的计时，不创建 User，到期时才创建
+    """
+    saved = {}
+    if state_store is not None:
+        for name, prompt_name, due, sent in state_store.proactive_states():
+            if users.prompt_names.get(name) == prompt_name:  # 更换了 prompt 的聊天不恢复
+                saved[name] = (due, sent)
+    now = time.time()
+    for name in users.names():
+        if worker_shard is not None and shard_of(name, worker_shard[1]) != worker_shard[0]:
+            continue  # 由其他工作进程排期
+        if proactive_scheduler.deadline(name) is not None:
+            continue  # 启动后已经收到消息
+        due, sent = saved.get(name, (None, 0))
+        if sent >= config["AUTO_MESSAGE_MAX_REPEAT"]:
+            continue
+        if due is None:
+            due = now + random.uniform(config["MIN_WAIT_TIME"], config["MAX_WAIT_TIME"]) * 3600
+        # 停机期间已经到期的打散到启动后的十分钟内
+        proactive_scheduler.schedule(name, max(due, now + random.uniform(0, 600)))
+
+
+async def dispatch_proactive():
+    """睡眠到最早到期的用户，每次收发消息只需 O(log n) 重排，不轮询所有用户"""
+    proactive_scheduler.bind(asyncio.get_running_loop())
+    while True:
+        for name in await proactive_scheduler.wait_due():
+            user = users.get(name)
+            resume = quiet_hours_end(datetime.now())
+            if resume is not None:
+                # 打散到时段结束后的十分钟内，避免所有用户同时触发
+                proactive_scheduler.schedule(name, resume + random.uniform(0, 600))
+                continue
+            with user.queue_lock:
+                busy = bool(user.inbox)
+            if busy or user.is_sending_message:
+                proactive_scheduler.schedule(name, time.time() + config['WAITING_TIME'])
+                continue
+            spawn(send_proactive_message(user))
+
+
+async def send_proactive_message(user):
+    """与普通回复走同样的限流和发送队列，但优先级最低"""
+    user.is_sending_message = True
+    try:
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        message = f"[{current_time}] {config['AUTO_MESSAGE']}"
+        logger.info(f"发送主动消息 - {user.name}")
+        async with llm_semaphore:
+            with metrics.span("llm_proactive", user.name):
+                # 指令不写入上下文，上下文中只留下发出去的主动消息
+                reply = await ai.get_deepseek_response(message, user, priority=RateLimiter.PRIORITY_PROACTIVE,
+                                                       remember=False)
+        if "</think>" in reply:
+            reply = reply.split("</think>", 1)[1].strip()
+        if not reply or reply in (ai.API_ERROR_REPLY, ai.BUSY_REPLY) or "## 记忆片段" in reply:
+            logger.warning(f"主动消息生成失败，跳过: {user.name}")
+            return
+        await send_reply(user, reply, priority=Dispatcher.PRIORITY_PROACTIVE)
+        user.proactive_sent += 1
+    finally:
+        user.is_sending_message = False
+        user.make_user_auto_time()
+        schedule_proactive(user)
+        save_state(user)
+
+
+def collect_runtime_metrics():
+    """导出时采集的队列深度和错误计数"""
+    samples = [
+        ("gauge", "wxbot_queue_depth", {"queue": "dispatcher"}, dispatcher.pending()),
+        ("gauge", "wxbot_queue_depth", {"queue": "vision"}, vision_pipeline.queue_depth()),
+        ("gauge", "wxbot_queue_depth", {"queue": "debounce"}, len(debounce_scheduler)),
+        ("gauge", "wxbot_queue_depth", {"queue": "proactive"}, len(proactive_scheduler)),
+        ("gauge", "wxbot_queue_depth", {"queue": "log_writer"}, log_writer.pending()),
+        ("gauge", "wxbot_background_tasks", {}, len(background_tasks)),
+        ("counter", "wxbot_rate_limited_total", {}, ai.limiter.stats["rate_limited"]),
+    ]
+    inboxes = [user.inbox for user in users.users()]
+    samples += [
+        ("gauge", "wxbot_inbox_messages", {}, sum(len(inbox) for inbox in inboxes)),
+        ("gauge", "wxbot_inbox_bytes", {}, sum(inbox.bytes for inbox in inboxes)),
+        ("counter", "wxbot_inbox_merged_total", {}, sum(inbox.merged for inbox in inboxes)),
+        ("counter", "wxbot_inbox_summarized_total", {}, sum(inbox.summarized for inbox in inboxes)),
+    ]
+    if supervisor is not None:
+        samples.append(("gauge", "wxbot_listener_replay_buffer", {}, len(replay_buffer)))
+        for key in ("recoveries", "reconnects", "resubscribed"):
+            samples.append(("counter", "wxbot_listener_total", {"kind": key}, supervisor.stats[key]))
+    for key, value in dispatcher.stats.items():
+        samples.append(("counter", "wxbot_dispatcher_total", {"kind": key}, value))
+    for key, value in ai.http_stats.items():
+        samples.append(("counter", "wxbot_http_total", {"kind": key}, value))
+    for provider in ai.router.providers:
+        samples.append(("counter", "wxbot_api_errors_total", {"provider": provider.name}, provider.errors))
+        samples.append(("gauge", "wxbot_circuit_open", {"provider": provider.name},
+                        int(provider.state != provider.CLOSED)))
+    for (provider, status), value in list(ai.router.status_counts.items()):
+        samples.append(("counter", "wxbot_api_responses_total", {"provider": provider, "status": status}, value))
+    return samples
+
+
+async def start_mcp_pool():
+    """连接配置的 MCP 服务器，失败时不启用工具调用"""
+    global mcp_pool
+    try:
+        from mcp_client import MCPPool  # mcp 为可选依赖，只在开启时导入
+        pool = MCPPool(config, logger)
+        await pool.start()
+        mcp_pool = pool
+    except Exception as e:
+        logger.error(f"MCP初始化失败，不使用工具调用: {str(e)}")
+
+
 async def send_message():
+    if config["MCP_SWITCH"]:
+        await start_mcp_pool()
+    try:
+        await dispatch_due_users()
+    finally:
+        # MCP 会话必须在创建它的任务中关闭
+        if mcp_pool is not None:
+            await mcp_pool.cleanup()
+
+
+async def dispatch_due_users():
+    global llm_semaphore
+    llm_semaphore = asyncio.Semaphore(config['MAX_CONCURRENT_LLM_CALLS'])
+    debounce_scheduler.bind(asyncio.get_running_loop())
+    vision_pipeline.start(asyncio.get_running_loop())
+    if config["ENABLE_AUTO_MESSAGE"]:
+        await asyncio.to_thread(seed_proactive)
+        spawn(dispatch_proactive())
+    if state_store is not None:
+        # 只立即恢复还有未回复消息的用户，其余用户在首次收到消息时恢复
+        for name in await asyncio.to_thread(state_store.pending_names):
+            if worker_shard is not None and shard_of(name, worker_shard[1]) != worker_shard[0]:
+                continue  # 由其他工作进程恢复
+            user = users.get(name)
+            if user is not None:
+                reschedule_pending(user)
+    user_tasks = {}  # 每个用户独立的处理流水线，互不阻塞
     while True:
-        tasks = []
-        current_time = time.time()
-        for user in user_list:
-            if user.user_queues and current_time - user.user_queues['last_message_time'] > config['WAITING_TIME'] and user.can_send_messages and not user.is_sending_message:
-                tasks.append(process_user_messages(user))
-        if tasks:
-            await asyncio.gather(*tasks)
-        await asyncio.sleep(1)
+        # 睡眠到最近的防抖截止时间，由 handle_wx_message 推送/重排
+        for name in await debounce_scheduler.wait_due():
+            user = users.get(name)
+            task = user_tasks.get(name)
+            if task is not None and not task.done():
+                continue  # 流水线结束时会重新排期
+            if not user.can_send_messages or user.is_sending_message:
+                reschedule_pending(user, delay=1)  # 图片识别中，稍后再试
+                continue
+            task = asyncio.create_task(process_user_messages(user))
+            task.add_done_callback(lambda _, u=user: reschedule_pending(u))
+            user_tasks[name] = task
+
+def start_sender():
+    """在新线程中运行消息处理的事件循环；循环和任务先创建好，stop_sender 随时都能取消"""
+    global sender_loop, sender_task, sender_thread
+    sender_loop = asyncio.new_event_loop()
+    sender_task = sender_loop.create_task(send_message())
+    sender_thread = threading.Thread(target=send_message_main, name="sender", daemon=True)
+    sender_thread.start()
+
+
+def stop_sender(timeout=10):
+    """取消消息处理循环，等待连接池、图片识别缓存和 MCP 会话关闭"""
+    if sender_thread is None:
+        return
+    if not sender_loop.is_closed():
+        sender_loop.call_soon_threadsafe(sender_task.cancel)
+    sender_thread.join(timeout)
+
 
 def send_message_main():
-    loop = asyncio.new_event_loop()
+    loop = sender_loop
     asyncio.set_event_loop(loop)
     try:
-        loop.run_until_complete(send_message())
+        loop.run_until_complete(sender_task)
+    except asyncio.CancelledError:
+        logger.info("消息处理循环已停止")
     except Exception as e:
         logger.error(f"消息处理循环发生错误: {str(e)}")
     finally:
+        # 仍在进行的回复、图片识别和主动消息一并取消
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(ai.close())
+        if media_cache is not None:
+            logger.info(f"图片识别缓存统计: {media_cache.get_stats()}")
+            media_cache.close()
         loop.close()
 
 
+def worker_main(index, inbound, outbound, acks):
+    """拆分模式的工作进程：处理分给本进程的聊天，回复交给前端进程发送"""
+    global worker_shard
+    bootstrap(role="worker")
+    worker_shard = (index, config["WORKER_PROCESSES"])
+    dispatcher.attach(index, outbound, acks)
+    logger.info(f"工作进程 {index} 已启动 (pid={os.getpid()})")
+    try:
+        if state_store is not None:
+            state_store.start()
+        if config["METRICS_SWITCH"]:
+            base, ext = os.path.splitext(os.path.join(root_dir, config["METRICS_FILE"]))
+            metrics.register_collector(collect_runtime_metrics)
+            metrics.start_exporter(path=f"{base}.worker{index}{ext}", interval=config["METRICS_EXPORT_INTERVAL"])
+
+        start_sender()
+        while True:
+            event = inbound.get()
+            if event is None:
+                break
+            accept_event(event)
+    finally:
+        stop_sender()
+        if state_store is not None:
+            state_store.close()
+        log_writer.close()
+        logger.info(f"工作进程 {index} 退出")
+
+
 ###################################### 启动线程 ################################################
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile-startup", action="store_true", help="打印导入和初始化耗时后退出")
+    args = parser.parse_args()
+
+    bootstrap()
+    if args.profile_startup:
+        wait_subscriptions()
+        print_startup_profile()
+        return
+    run()
+
+
+def run():
+    global worker_pool
+    profiler = None
     try:
         # 确保临时目录存在
         memory_temp_dir = os.path.join(root_dir, config['MEMORY_TEMP_DIR'])
         os.makedirs(memory_temp_dir, exist_ok=True)
 
-        # clean_up_temp_files()
+        clean_temp_files()
 
-        global wx
-        wx = WeChat()
+        if state_store is not None:
+            state_store.start()
 
+        # 先启动处理消息的一方，监听线程收到的第一批消息才有去处
+        if config["SPLIT_MODE"]:
+            worker_pool = WorkerPool(logger=logger, config=config, dispatcher=dispatcher)
+            worker_pool.start(worker_main)
+        else:
+            start_sender()
+
+        wait_subscriptions()
         listener_thread = threading.Thread(target=message_listener)
         listener_thread.daemon = True
         listener_thread.start()
 
-        checker_thread = threading.Thread(target=send_message_main)
-        checker_thread.daemon = True
-        checker_thread.start()
+        if config["PROFILER_SWITCH"]:
+            # 对监听线程定期采样调用栈，用于定位轮询和UI调用中的耗时
+            profiler = SamplingProfiler(logger=logger, thread=listener_thread, interval=config["PROFILER_INTERVAL"],
+                                        output=os.path.join(root_dir, config["PROFILER_FILE"]))
+            profiler.start()
+
+        if config["METRICS_SWITCH"]:
+            metrics.register_collector(collect_runtime_metrics)
+            metrics.start_exporter(path=os.path.join(root_dir, config["METRICS_FILE"]), port=config["METRICS_PORT"],
+                                   interval=config["METRICS_EXPORT_INTERVAL"])
 
         # if ENABLE_MEMORY:
         #     # 启动记忆管理线程
@@ -340,10 +952,6 @@ def main():
         #     memory_thread.daemon = True
         #     memory_thread.start()
 
-        # # 启动后台线程来检查用户超时
-        # if ENABLE_AUTO_MESSAGE:
-        #     threading.Thread(target=check_user_timeouts, daemon=True).start()
-
         logger.info("开始运行BOT...")
 
         while True:
@@ -355,6 +963,16 @@ def main():
         print(f"\033[31m错误：{str(e)}\033[0m")
         exit(1)
     finally:
+        if worker_pool is not None:
+            worker_pool.close()
+            logger.info(f"工作进程统计: {worker_pool.stats}")
+        if profiler is not None:
+            profiler.stop()
+        stop_sender()
+        if state_store is not None:
+            state_store.close()
+            logger.info(f"用户状态统计: {state_store.stats}")
+        log_writer.close()
         logger.info("程序退出")
 
 
@@ -1,31 +1,90 @@
 import asyncio
-from openai import OpenAI
-from mcp import ClientSession, StdioServerParameters
 import json
-from typing import Optional
-from contextlib import AsyncExitStack
+import logging
 import os
-from dotenv import load_dotenv
+import time
+from contextlib import AsyncExitStack
+from typing import Optional
 
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
-# 加载环境变量
-load_dotenv()
 
-# 从环境变量获取配置
-DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'sk-c75206b1e7d54fa4b58fa1a6d5402586')
-DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
-DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+class MCPToolRunner:
+    """
+    MCP 会话与多轮工具调用，不包含模型客户端：每一轮的模型请求由调用方传入的 complete 发出
+    子类实现 get_tools / call_tool
+    """
+
+    def __init__(self, max_tool_rounds: int, logger: Optional[logging.Logger] = None):
+        self.exit_stack = AsyncExitStack()
+        self.max_tool_rounds = max_tool_rounds
+        self.logger = logger or logging.getLogger(__name__)
+        self._tools: Optional[list] = None  # 工具列表缓存，服务器通知变更或重连时失效
+
+    def invalidate_tools(self):
+        self._tools = None
+
+    async def get_tools(self) -> list:
+        raise NotImplementedError
+
+    async def call_tool(self, tool_call: dict) -> dict:
+        raise NotImplementedError
+
+    async def run_tool_loop(self, messages: list, complete) -> tuple:
+        """
+        多轮工具调用：每轮模型返回的所有工具调用并发执行，结果加入上下文后继续，
+        直到模型不再调用工具或达到 max_tool_rounds
+        complete(messages, tools) 发出每一轮的模型请求，返回 assistant 消息（dict）；
+        返回 (回复, 每轮耗时)，耗时随结果返回，并发的查询互不覆盖
+        """
+        messages = list(messages)
+        tools = await self.get_tools()
+        timings = []
+        for round_index in range(self.max_tool_rounds + 1):
+            started = time.perf_counter()
+            # 最后一轮不再提供工具，强制模型给出回答
+            message = await complete(messages, tools if round_index < self.max_tool_rounds else None)
+            llm_time = time.perf_counter() - started
+
+            tool_calls = message.get("tool_calls")
+            if not tool_calls:
+                timings.append({"round": round_index, "llm": llm_time, "tools": 0.0, "calls": 0})
+                return message.get("content"), timings
+
+            messages.append({"role": "assistant", "content": message.get("content"), "tool_calls": tool_calls})
+            started = time.perf_counter()
+            results = await asyncio.gather(*(self.call_tool(tool_call) for tool_call in tool_calls))
+            tool_time = time.perf_counter() - started
+            messages.extend(results)
+
+            timings.append({"round": round_index, "llm": llm_time, "tools": tool_time, "calls": len(tool_calls)})
+            self.logger.debug(f"[第 {round_index + 1} 轮] 模型 {llm_time:.2f}s, {len(tool_calls)} 个工具 {tool_time:.2f}s")
+            tools = await self.get_tools()  # 工具列表可能在调用过程中变化
 
+        return message.get("content"), timings
+
+    async def cleanup(self):
+        """清理资源"""
+        await self.exit_stack.aclose()
+
+
+class MCPClient(MCPToolRunner):
+    """独立运行的命令行客户端：单个服务器，用自己的 AsyncOpenAI 客户端请求模型"""
 
-class MCPClient:
     def __init__(self):
         """初始化 MCP 客户端"""
-        self.exit_stack = AsyncExitStack()
-        self.openai_api_key = DEEPSEEK_API_KEY
-        self.base_url = DEEPSEEK_BASE_URL
-        self.model = DEEPSEEK_MODEL
-        self.client = OpenAI(api_key=self.openai_api_key, base_url=self.base_url)
+        # 只有独立运行时需要，机器人中的 MCPPool 通过 Router 请求模型，不依赖 openai / dotenv
+        from dotenv import load_dotenv
+        from openai import AsyncOpenAI
+
+        # 从环境变量获取配置
+        load_dotenv()
+        super().__init__(int(os.getenv('MCP_MAX_TOOL_ROUNDS', '5')))
+        self.openai_api_key = os.getenv('DEEPSEEK_API_KEY', 'sk-c75206b1e7d54fa4b58fa1a6d5402586')
+        self.base_url = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
+        self.model = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+        self.client = AsyncOpenAI(api_key=self.openai_api_key, base_url=self.base_url)
         self.session: Optional[ClientSession] = None
 
     async def connect_to_mock_server(self, server_script_path: str):
@@ -47,66 +106,71 @@ class MCPClient:
             stdio_client(server_params)
         )
         self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+        try:
+            session = ClientSession(self.stdio, self.write, message_handler=self._on_server_message)
+        except TypeError:  # 旧版 mcp 不支持 message_handler，只能在重连或调用出错时刷新缓存
+            session = ClientSession(self.stdio, self.write)
+        self.session = await self.exit_stack.enter_async_context(session)
 
         await self.session.initialize()
+        self.invalidate_tools()
 
         # 列出 MCP 服务器上的工具
-        response = await self.session.list_tools()
-        tools = response.tools
-        print("\n已连接到服务器，支持以下工具:", [tool.name for tool in tools])
+        tools = await self.get_tools()
+        print("\n已连接到服务器，支持以下工具:", [tool["function"]["name"] for tool in tools])
 
-    async def process_query(self, query: str) -> str:
-        """使用大模型处理查询并调用可用的 MCP 工具 (Function Calling)"""
-        try:
-            messages = [{"role": "user", "content": query}]
+    async def _on_server_message(self, message):
+        """服务器通知工具列表变化时清空缓存"""
+        if isinstance(message, types.ServerNotification) and \
+                isinstance(message.root, types.ToolListChangedNotification):
+            self.invalidate_tools()
+
+    async def get_tools(self) -> list:
+        """返回 OpenAI function calling 格式的工具列表（带缓存）"""
+        if self._tools is None:
             response = await self.session.list_tools()
-            available_tools = [{
+            self._tools = [{
                 "type": "function",
                 "function": {
                     "name": tool.name,
                     "description": tool.description,
-                    "input_schema": tool.inputSchema
+                    "parameters": tool.inputSchema
                 }
             } for tool in response.tools]
+        return self._tools
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                tools=available_tools
-            )
+    async def call_tool(self, tool_call: dict) -> dict:
+        """执行一个工具调用，返回 role=tool 的消息"""
+        tool_name = tool_call["function"]["name"]
+        try:
+            tool_args = json.loads(tool_call["function"].get("arguments") or "{}")
+            self.logger.info(f"调用工具 {tool_name}，参数 {tool_args}")
+            result = await self.session.call_tool(tool_name, tool_args)
+            content = "\n".join(item.text for item in result.content if getattr(item, "text", None))
+        except Exception as e:
+            if "unknown tool" in str(e).lower() or "not found" in str(e).lower():
+                self.invalidate_tools()  # 服务器的工具可能已经变化
+            self.logger.error(f"工具调用失败: {str(e)}")
+            content = f"工具调用失败: {str(e)}"
+        return {"role": "tool", "content": content, "tool_call_id": tool_call["id"]}
 
-            content = response.choices[0]
-            if content.finish_reason == "tool_calls":
-                tool_call = content.message.tool_calls[0]
-                tool_name = tool_call.function.name
-                tool_args = json.loads(tool_call.function.arguments)
+    async def complete(self, messages: list, tools: Optional[list]) -> dict:
+        """请求一轮模型回复，返回 assistant 消息（dict）"""
+        kwargs = {"tools": tools} if tools else {}
+        response = await self.client.chat.completions.create(model=self.model, messages=messages, **kwargs)
+        return response.choices[0].message.model_dump(exclude_none=True)
 
-                try:
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    print(f"\n\n[Calling tool {tool_name} with args {tool_args}]\n\n")
-
-                    messages.append(content.message.model_dump())
-                    messages.append({
-                        "role": "tool",
-                        "content": result.content[0].text,
-                        "tool_call_id": tool_call.id,
-                    })
-
-                    #############对messages进行修改#############
-
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                    )
-                    return response.choices[0].message.content
-                except Exception as e:
-                    print(f"工具调用失败: {str(e)}")
-                    return f"抱歉，工具调用失败: {str(e)}"
+    async def process_query(self, query: str) -> str:
+        """使用大模型处理查询并调用可用的 MCP 工具 (Function Calling)"""
+        return await self.process_messages([{"role": "user", "content": query}])
 
-            return response.message.content
+    async def process_messages(self, messages: list) -> str:
+        """处理完整的对话消息，出错时返回提示文本"""
+        try:
+            reply, _ = await self.run_tool_loop(messages, self.complete)
+            return reply
         except Exception as e:
-            print(f"处理查询时发生错误: {str(e)}")
+            self.logger.error(f"处理查询时发生错误: {str(e)}")
             return f"抱歉，处理您的请求时发生错误: {str(e)}"
 
     async def chat_loop(self):
@@ -129,12 +193,117 @@ class MCPClient:
             print("\n正在清理资源...")
             await self.cleanup()
 
-    async def cleanup(self):
-        """清理资源"""
-        await self.exit_stack.aclose()
+
+class MCPPool(MCPToolRunner):
+    """
+    供微信机器人使用的 MCP 连接池：启动时连接 MCP_SERVERS 中的所有服务器并保持会话，
+    工具按名称路由到所属服务器；MCP_CACHEABLE_TOOLS 中的确定性工具结果按 MCP_TOOL_CACHE_TTL 缓存；
+    模型请求由调用方传入的 complete 发出（经过 Router 的限流、回退和熔断）
+    """
+
+    def __init__(self, config, logger):
+        super().__init__(config["MCP_MAX_TOOL_ROUNDS"], logger)
+        self.server_configs = config["MCP_SERVERS"]
+        self.cacheable_tools = set(config["MCP_CACHEABLE_TOOLS"])
+        self.cache_ttl = config["MCP_TOOL_CACHE_TTL"]
+        self.sessions = {}  # 服务器名称 -> ClientSession
+        self.tool_servers = {}  # 工具名称 -> 服务器名称
+        self._server_tools = {}  # 服务器名称 -> 工具列表缓存
+        self._results = {}  # (工具, 参数json) -> (过期时间, 结果)
+        self.stats = {"tool_calls": 0, "cache_hits": 0}
+
+    async def start(self):
+        """连接所有服务器（只在启动时执行一次），单个服务器失败不影响其他服务器"""
+        for server in self.server_configs:
+            try:
+                await self._connect(server)
+            except Exception as e:
+                self.logger.error(f"连接MCP服务器 {server['name']} 失败: {str(e)}")
+        tools = await self.get_tools()
+        self.logger.info(f"MCP已连接 {len(self.sessions)} 个服务器，工具: {[t['function']['name'] for t in tools]}")
+
+    async def _connect(self, server):
+        name = server["name"]
+        params = StdioServerParameters(command=server["command"], args=server.get("args", []),
+                                       env=server.get("env"))
+        read, write = await self.exit_stack.enter_async_context(stdio_client(params))
+
+        async def on_message(message, server_name=name):
+            if isinstance(message, types.ServerNotification) and \
+                    isinstance(message.root, types.ToolListChangedNotification):
+                self.invalidate_tools(server_name)
+
+        try:
+            session = ClientSession(read, write, message_handler=on_message)
+        except TypeError:
+            session = ClientSession(read, write)
+        session = await self.exit_stack.enter_async_context(session)
+        await session.initialize()
+        self.sessions[name] = session
+        self.invalidate_tools(name)
+
+    def invalidate_tools(self, server_name=None):
+        self._tools = None
+        if server_name is None:
+            self._server_tools.clear()
+        else:
+            self._server_tools.pop(server_name, None)
+
+    async def get_tools(self) -> list:
+        if self._tools is not None:
+            return self._tools
+        tools, self.tool_servers = [], {}
+        for name, session in self.sessions.items():
+            if name not in self._server_tools:
+                response = await session.list_tools()
+                self._server_tools[name] = [{
+                    "type": "function",
+                    "function": {
+                        "name": tool.name,
+                        "description": tool.description,
+                        "parameters": tool.inputSchema
+                    }
+                } for tool in response.tools]
+            for tool in self._server_tools[name]:
+                tool_name = tool["function"]["name"]
+                if tool_name in self.tool_servers:
+                    self.logger.warning(f"MCP工具重名，忽略 {name} 中的 {tool_name}")
+                    continue
+                self.tool_servers[tool_name] = name
+                tools.append(tool)
+        self._tools = tools
+        return tools
+
+    async def call_tool(self, tool_call: dict) -> dict:
+        tool_name = tool_call["function"]["name"]
+        self.stats["tool_calls"] += 1
+        try:
+            tool_args = json.loads(tool_call["function"].get("arguments") or "{}")
+            key = (tool_name, json.dumps(tool_args, sort_keys=True, ensure_ascii=False))
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.stats["cache_hits"] += 1
+                return {"role": "tool", "content": cached[1], "tool_call_id": tool_call["id"]}
+
+            server_name = self.tool_servers.get(tool_name)
+            if server_name is None:
+                self.invalidate_tools()
+                raise ValueError(f"unknown tool {tool_name}")
+            result = await self.sessions[server_name].call_tool(tool_name, tool_args)
+            content = "\n".join(item.text for item in result.content if getattr(item, "text", None))
+            if tool_name in self.cacheable_tools and not getattr(result, "isError", False):
+                now = time.monotonic()
+                if len(self._results) > 1024:
+                    self._results = {k: v for k, v in self._results.items() if v[0] > now}
+                self._results[key] = (now + self.cache_ttl, content)
+        except Exception as e:
+            self.logger.error(f"MCP工具调用失败 {tool_name}: {str(e)}")
+            content = f"工具调用失败: {str(e)}"
+        return {"role": "tool", "content": content, "tool_call_id": tool_call["id"]}
 
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
     client = MCPClient()
     try:
         await client.connect_to_mock_server('.\server.py')
@@ -1,11 +1,17 @@
+import asyncio
 import base64
-import aiohttp
+import json
 
-import requests
-from openai import OpenAI
+from model.ImagePrep import prepare_image
+from model.ReplySegmenter import ReplySegmenter
+from model.Router import ProviderError, Router
+from model.RateLimiter import RateLimiter
 
 
 class Ai:
+    API_ERROR_REPLY = "服务响应异常，请稍后再试"
+    BUSY_REPLY = "抱歉，我现在有点忙，稍后再聊吧。"
+
     def __init__(self, logger, config):
         self.config = config
         self.logger = logger
@@ -18,36 +24,94 @@ class Ai:
         self.MAX_TOKEN = config["MAX_TOKEN"]
         self.TEMPERATURE = config["TEMPERATURE"]
         self.MOONSHOT_TEMPERATURE = config["MOONSHOT_TEMPERATURE"]
-        self.openai_client = self.get_client()
+        self.session = None  # 长连接池，在发送线程的事件循环中懒加载
+        self.http_stats = {"requests": 0, "new_connections": 0, "reused_connections": 0, "dns_lookups": 0}
+        self.limiter = RateLimiter(logger=logger, config=config)  # 文本和图片识别共用
+        self.router = Router(logger=logger, config=config, session_getter=self.get_session, limiter=self.limiter)
+
+    def get_session(self):
+        """
+        获取共享的 aiohttp 会话（keep-alive 连接池）
+        必须在发送线程的事件循环中调用，首次调用时创建
+        """
+        if self.session is not None and not self.session.closed:
+            return self.session
 
-    def get_client(self):
-        return OpenAI(api_key=self.DEEPSEEK_API_KEY, base_url=self.DEEPSEEK_BASE_URL)
+        import aiohttp  # 导入较慢，第一次请求时才导入，不拖慢启动
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
 
-    def moonshot_image(self, image_path, is_emoji=False, user=None):
-        with open(image_path, 'rb') as img_file:
-            image_content = base64.b64encode(img_file.read()).decode('utf-8')
-        headers = {
-            'Authorization': f'Bearer {self.MOONSHOT_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        text_prompt = "请描述这个图片" if not is_emoji else "请描述这个聊天窗口的最后一张表情包"
-        data = {
-            "model": self.MOONSHOT_MODEL,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_content}"}},
-                        {"type": "text", "text": text_prompt}
-                    ]
-                }
-            ],
-            "temperature": self.MOONSHOT_TEMPERATURE
-        }
+        connector = aiohttp.TCPConnector(
+            limit=self.config["HTTP_POOL_SIZE"],
+            limit_per_host=self.config["HTTP_POOL_PER_HOST"],
+            keepalive_timeout=self.config["HTTP_KEEPALIVE_TIMEOUT"],
+            ttl_dns_cache=self.config["HTTP_DNS_CACHE_TTL"],
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=self.config["HTTP_TOTAL_TIMEOUT"],
+            connect=self.config["HTTP_CONNECT_TIMEOUT"],
+        )
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace_config])
+        self.logger.info(f"已创建HTTP连接池: limit={self.config['HTTP_POOL_SIZE']}, "
+                         f"per_host={self.config['HTTP_POOL_PER_HOST']}")
+        return self.session
+
+    async def close(self):
+        """关闭连接池，在事件循环退出前调用"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+            self.logger.info(f"HTTP连接池已关闭: {self.get_http_stats()}")
+            self.logger.info(f"服务商统计: {self.router.get_stats()}")
+        self.session = None
+
+    def get_http_stats(self):
+        """连接复用统计：新建连接数即 TCP/TLS 握手次数"""
+        stats = dict(self.http_stats)
+        total = stats["new_connections"] + stats["reused_connections"]
+        stats["reuse_ratio"] = round(stats["reused_connections"] / total, 3) if total else 0.0
+        return stats
+
+    async def _on_request_start(self, session, ctx, params):
+        self.http_stats["requests"] += 1
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self.http_stats["new_connections"] += 1
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self.http_stats["reused_connections"] += 1
+
+    async def _on_dns_resolvehost_end(self, session, ctx, params):
+        self.http_stats["dns_lookups"] += 1
+
+    async def moonshot_image(self, image_path, is_emoji=False):
+        """
+        异步调用 Moonshot 视觉接口识别图片，失败时返回空字符串
+        """
         try:
-            response = requests.post(f"{self.MOONSHOT_BASE_URL}/chat/completions", headers=headers, json=data)
-            response.raise_for_status()
-            result = response.json()
+            image_bytes, mime = await asyncio.to_thread(prepare_image, image_path, is_emoji, self.config, self.logger)
+            image_content = base64.b64encode(image_bytes).decode('utf-8')
+            headers = {
+                'Authorization': f'Bearer {self.MOONSHOT_API_KEY}',
+                'Content-Type': 'application/json'
+            }
+            text_prompt = "请描述这个图片" if not is_emoji else "请描述这个聊天窗口的最后一张表情包"
+            data = {
+                "model": self.MOONSHOT_MODEL,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_content}"}},
+                            {"type": "text", "text": text_prompt}
+                        ]
+                    }
+                ],
+                "temperature": self.MOONSHOT_TEMPERATURE
+            }
+            result = await self.post_vision(headers, data, tokens=len(image_content) // 1000 + 100)
             recognized_text = result['choices'][0]['message']['content']
             if is_emoji:
                 if "最后一张表情包是" in recognized_text:
@@ -56,76 +120,189 @@ class Ai:
             else:
                 recognized_text = "发送了图片：" + recognized_text
             self.logger.info(f"Moonshot AI图片识别结果: {recognized_text}")
-            if user:
-                user.can_send_messages = True
             return recognized_text
 
         except Exception as e:
             self.logger.error(f"调用Moonshot AI识别图片失败: {str(e)}")
-            if user:
-                user.can_send_messages = True
             return ""
 
-    async def get_deepseek_response(self, message, user):
+    async def post_vision(self, headers, data, tokens):
+        """图片识别请求：与文本请求共用限流器，429时按Retry-After退避重试"""
+        session = self.get_session()
+        for attempt in range(self.config["RATE_LIMIT_MAX_RETRIES"] + 1):
+            await self.limiter.acquire("moonshot", tokens, RateLimiter.PRIORITY_INTERACTIVE)
+            async with session.post(f"{self.MOONSHOT_BASE_URL}/chat/completions", headers=headers, json=data) as response:
+                if response.status == 429 and attempt < self.config["RATE_LIMIT_MAX_RETRIES"]:
+                    self.limiter.penalize("moonshot", response.headers.get("Retry-After"))
+                    continue
+                response.raise_for_status()
+                self.limiter.succeed("moonshot")
+                return await response.json()
+
+    def build_messages(self, message, user, memory=None, remember=True):
+        """
+        把本轮消息加入上下文，返回发送给模型的 messages（受 CONTEXT_TOKEN_BUDGET 限制）
+        remember=False 时本轮消息只用于这次请求，不写入上下文（如主动消息的指令）
+        """
+        if not remember:
+            return user.context.messages(user.prompt, memory=memory) + [{"role": "user", "content": message}]
+        user.context.append("user", message)
+        return user.context.messages(user.prompt, memory=memory)
+
+    async def compact_context(self, user):
+        """
+        把超出预算的早期对话合并进滚动摘要
+        开启 CONTEXT_SUMMARY_SWITCH 时由模型生成摘要，失败或关闭时本地截取
+        """
+        if not user.context.needs_compaction():
+            return
+        evicted = user.context.take_evicted()
+        if not self.config["CONTEXT_SUMMARY_SWITCH"]:
+            user.context.compact_locally(evicted)
+            return
+
+        history = "\n".join(
+            f"{'用户' if message['role'] == 'user' else '你'}: {message['content']}" for message in evicted
+        )
+        prompt = (f"请把下面的已有摘要和新增对话合并成一段不超过{self.config['SUMMARY_TOKEN_BUDGET']}字的摘要，"
+                  f"保留人物、事实、约定和情绪变化，只输出摘要本身。\n"
+                  f"已有摘要：{user.context.summary or '无'}\n新增对话：\n{history}")
+        try:
+            payload = self.build_payload([{"role": "user", "content": prompt}])
+            payload["temperature"] = 0.3
+            result, _ = await self.router.complete(payload, priority=RateLimiter.PRIORITY_BACKGROUND)
+            summary = result['choices'][0]['message']['content']
+            if "</think>" in summary:
+                summary = summary.split("</think>", 1)[1]
+            user.context.set_summary(summary)
+            self.logger.info(f"已压缩 {user.name} 的 {len(evicted)} 条早期对话")
+        except Exception as e:
+            self.logger.warning(f"对话摘要生成失败，改为本地压缩: {str(e)}")
+            user.context.compact_locally(evicted)
+
+    def build_payload(self, messages, stream=False):
+        return {
+            "model": self.DEEPSEEK_MODEL,
+            "messages": messages,
+            "temperature": self.TEMPERATURE,
+            "max_tokens": self.MAX_TOKEN,
+            "stream": stream
+        }
+
+    async def get_deepseek_response(self, message, user, memory=None, priority=RateLimiter.PRIORITY_INTERACTIVE,
+                                    remember=True):
         """
         异步版本的DeepSeek响应获取方法
         """
         try:
             self.logger.info(f"调用 Chat API - 用户ID: {user.name}, 消息: {message}")
-            user_prompt = user.prompt
-            user.chat_contexts.append({"role": "user", "content": message})
-
-            MAX_GROUPS = 10
-            while len(user.chat_contexts) > MAX_GROUPS * 2:
-                user.chat_contexts.pop(0)
-
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.DEEPSEEK_BASE_URL}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.DEEPSEEK_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": self.DEEPSEEK_MODEL,
-                        "messages": [
-                            {"role": "system", "content": user_prompt},
-                            *user.chat_contexts[-MAX_GROUPS * 2:]
-                        ],
-                        "temperature": self.TEMPERATURE,
-                        "max_tokens": self.MAX_TOKEN,
-                        "stream": False
-                    }
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        self.logger.error(f"API请求失败: {error_text}")
-                        return "服务响应异常，请稍后再试"
+            messages = self.build_messages(message, user, memory=memory, remember=remember)
+
+            result, provider = await self.router.complete(self.build_payload(messages), priority=priority)
+            reply = result['choices'][0]['message']['content'].strip()
+            user.context.append("assistant", reply)
 
-                    result = await response.json()
-                    if not result.get('choices'):
-                        user.logger.error("API返回空choices")
-                        return "服务响应异常，请稍后再试"
+            self.logger.info(f"API回复({provider}): {reply}")
+            return reply
+
+        except ProviderError as e:
+            self.logger.error(f"API请求失败: {str(e)}")
+            return self.API_ERROR_REPLY
+        except Exception as e:
+            self.report_error(e)
+            return self.BUSY_REPLY
+
+    async def get_mcp_response(self, message, user, mcp_pool, memory=None,
+                               priority=RateLimiter.PRIORITY_INTERACTIVE):
+        """
+        通过 MCP 工具调用生成回复，工具链路失败时回退到普通请求
+        """
+        try:
+            self.logger.info(f"调用 Chat API(MCP) - 用户ID: {user.name}, 消息: {message}")
+            messages = self.build_messages(message, user, memory=memory)
 
-                    reply = result['choices'][0]['message']['content'].strip()
-                    user.chat_contexts.append({"role": "assistant", "content": reply})
+            async def complete(round_messages, tools):
+                # 每一轮都经过 Router：按次限流、429 退避、服务商回退和熔断
+                payload = self.build_payload(round_messages)
+                if tools:
+                    payload["tools"] = tools
+                result, _ = await self.router.complete(payload, priority=priority)
+                return result['choices'][0]['message']
 
-                    self.logger.info(f"API回复: {reply}")
-                    return reply
+            try:
+                reply, timings = await mcp_pool.run_tool_loop(messages, complete)
+                self.logger.info(f"MCP各轮耗时: {timings}")
+            except ProviderError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"MCP工具调用失败，改为普通请求: {str(e)}")
+                result, _ = await self.router.complete(self.build_payload(messages), priority=priority)
+                reply = result['choices'][0]['message']['content']
+            reply = (reply or "").strip()
+            user.context.append("assistant", reply)
+            self.logger.info(f"API回复(MCP): {reply}")
+            return reply
 
+        except ProviderError as e:
+            self.logger.error(f"API请求失败: {str(e)}")
+            return self.API_ERROR_REPLY
         except Exception as e:
-            ErrorImformation = str(e)
-            self.logger.error(f"Chat调用失败: {str(e)}", exc_info=True)
-            if "real name verification" in ErrorImformation:
-                print("\033[31m错误：API服务商反馈请完成实名认证后再使用！ \033[0m")
-            elif "rate" in ErrorImformation:
-                print("\033[31m错误：API服务商反馈当前访问API服务频次达到上限，请稍后再试！ \033[0m")
-            elif "paid" in ErrorImformation:
-                print("\033[31m错误：API服务商反馈您正在使用付费模型，请先充值再使用或使用免费额度模型！ \033[0m")
-            elif "Api key is invalid" in ErrorImformation:
-                print("\033[31m错误：API服务商反馈API KEY不可用，请检查配置选项！ \033[0m")
-            elif "busy" in ErrorImformation:
-                print("\033[31m错误：API服务商反馈服务器繁忙，请稍后再试！ \033[0m")
-            else:
-                print("\033[31m错误： " + str(e) + "\033[0m")
-            return "抱歉，我现在有点忙，稍后再聊吧。"
\ No newline at end of file
+            self.report_error(e)
+            return self.BUSY_REPLY
+
+    async def stream_deepseek_response(self, message, user, memory=None, priority=RateLimiter.PRIORITY_INTERACTIVE):
+        """
+        流式获取DeepSeek回复，每当一个以'\\'分隔的分段完整时立即产出
+        推理内容（</think>之前）和记忆片段不会产出
+        """
+        segmenter = ReplySegmenter()
+        try:
+            self.logger.info(f"调用 Chat API(流式) - 用户ID: {user.name}, 消息: {message}")
+            messages = self.build_messages(message, user, memory=memory)
+
+            async for raw_line in self.router.stream(self.build_payload(messages, stream=True), priority=priority):
+                line = raw_line.decode('utf-8').strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    continue  # 读到流结束，让连接正常归还连接池
+                choices = json.loads(data).get('choices')
+                if not choices:
+                    continue
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    for segment in segmenter.feed(delta):
+                        yield segment
+
+            for segment in segmenter.flush():
+                yield segment
+
+            reply = segmenter.text.strip()
+            user.context.append("assistant", reply)
+            self.logger.info(f"API回复(流式): {reply}")
+
+        except ProviderError as e:
+            self.logger.error(f"API请求失败: {str(e)}")
+            if not segmenter.emitted:
+                yield self.API_ERROR_REPLY
+        except Exception as e:
+            self.report_error(e)
+            if not segmenter.emitted:
+                yield self.BUSY_REPLY
+
+    def report_error(self, e):
+        ErrorImformation = str(e)
+        self.logger.error(f"Chat调用失败: {str(e)}", exc_info=True)
+        if "real name verification" in ErrorImformation:
+            print("\033[31m错误：API服务商反馈请完成实名认证后再使用！ \033[0m")
+        elif "rate" in ErrorImformation:
+            print("\033[31m错误：API服务商反馈当前访问API服务频次达到上限，请稍后再试！ \033[0m")
+        elif "paid" in ErrorImformation:
+            print("\033[31m错误：API服务商反馈您正在使用付费模型，请先充值再使用或使用免费额度模型！ \033[0m")
+        elif "Api key is invalid" in ErrorImformation:
+            print("\033[31m错误：API服务商反馈API KEY不可用，请检查配置选项！ \033[0m")
+        elif "busy" in ErrorImformation:
+            print("\033[31m错误：API服务商反馈服务器繁忙，请稍后再试！ \033[0m")
+        else:
+            print("\033[31m错误： " + str(e) + "\033[0m")
@@ -0,0 +1,114 @@
+import math
+from collections import deque
+
+
+def estimate_tokens(text):
+    """本地粗略估算token数：中日韩字符约0.6个token，其余字符约4个算1个"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uac00' <= ch <= '\ud7af' or '\uff00' <= ch <= '\uffef')
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) / 4)
+
+
+class ChatContext:
+    """
+    用户对话上下文：按token预算保留最近的对话，
+    超出预算的较早对话先放入待压缩列表，再合并进滚动摘要；
+    超出时一次裁剪到低水位，留出余量，压缩不会每轮都发生
+    """
+
+    __slots__ = ("budget", "low_water", "summary_budget", "turns", "tokens", "summary", "evicted", "compacting")
+
+    MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等开销
+
+    def __init__(self, config):
+        self.budget = config["CONTEXT_TOKEN_BUDGET"]
+        self.low_water = config["CONTEXT_LOW_WATER"]
+        self.summary_budget = config["SUMMARY_TOKEN_BUDGET"]
+        self.turns = deque()  # (message, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.evicted = []  # 等待压缩进摘要的消息
+        self.compacting = False  # 同一用户同时只进行一次压缩
+
+    def append(self, role, content):
+        message = {"role": role, "content": content}
+        tokens = estimate_tokens(content) + self.MESSAGE_OVERHEAD
+        self.turns.append((message, tokens))
+        self.tokens += tokens
+        self.trim()
+
+    def trim(self):
+        """超出预算时从最早的消息开始移出，直到低于低水位，至少保留最新一条"""
+        budget = self.budget - estimate_tokens(self.summary)
+        if self.tokens <= budget:
+            return
+        while self.tokens > budget * self.low_water and len(self.turns) > 1:
+            message, tokens = self.turns.popleft()
+            self.tokens -= tokens
+            self.evicted.append(message)
+
+    def messages(self, system_prompt, memory=None):
+        """组装发送给模型的messages：系统prompt + 摘要 + 检索到的历史片段 + 最近对话"""
+        messages = [{"role": "system", "content": system_prompt}]
+        if memory:
+            messages.append({"role": "system", "content": f"以下是与当前话题相关的历史聊天记录：\n{memory}"})
+        if self.summary:
+            messages.append({"role": "system", "content": f"以下是你们更早之前对话的摘要：\n{self.summary}"})
+        messages.extend(message for message, _ in self.turns)
+        return messages
+
+    def needs_compaction(self):
+        return bool(self.evicted)
+
+    def take_evicted(self):
+        evicted, self.evicted = self.evicted, []
+        return evicted
+
+    def set_summary(self, summary):
+        self.summary = self.clip(summary.strip(), self.summary_budget)
+        self.trim()
+
+    def compact_locally(self, evicted):
+        """不调用模型的压缩：每条消息截取开头追加到摘要，超出预算时丢弃摘要最早的部分"""
+        lines = [self.summary] if self.summary else []
+        for message in evicted:
+            speaker = "用户" if message["role"] == "user" else "你"
+            lines.append(f"{speaker}: {self.clip(message['content'], 40)}")
+        summary = "\n".join(lines)
+        while estimate_tokens(summary) > self.summary_budget and "\n" in summary:
+            summary = summary.split("\n", 1)[1]
+        self.set_summary(summary)
+
+    @staticmethod
+    def clip(text, max_tokens):
+        """截断到大约max_tokens个token"""
+        if estimate_tokens(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if estimate_tokens(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low] + "…"
+
+    def to_dict(self):
+        return {
+            "turns": [message for message, _ in list(self.turns)],
+            "summary": self.summary,
+            "evicted": list(self.evicted),
+        }
+
+    def load(self, state):
+        """从快照恢复，按当前预算重新计算token"""
+        self.turns.clear()
+        self.tokens = 0
+        self.summary = state.get("summary", "")
+        self.evicted = list(state.get("evicted", []))
+        for message in state.get("turns", []):
+            self.append(message["role"], message["content"])
+
+    def __len__(self):
+        return len(self.turns)
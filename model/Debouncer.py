@@ -0,0 +1,67 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class Debouncer:
+    """
+    按 key 防抖：同一 key 的新调用会替换尚未执行的旧调用，不同 key 互不影响
+    所有 key 共享一个定时线程，不会为每次调用创建新线程
+    """
+
+    def __init__(self, logger, name="debouncer"):
+        self.logger = logger
+        self.name = name
+        self._heap = []  # (deadline, seq, key)
+        self._pending = {}  # key -> (seq, callback)
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, key, delay, callback):
+        """delay 秒后执行 callback，期间同一 key 的再次调用会重新计时"""
+        with self._cond:
+            seq = next(self._counter)
+            self._pending[key] = (seq, callback)
+            heapq.heappush(self._heap, (time.monotonic() + delay, seq, key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            self._pending.pop(key, None)
+
+    def pending(self, key):
+        with self._cond:
+            return key in self._pending
+
+    def _next_due(self):
+        """在锁内等待并取出下一个到期的回调"""
+        while True:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            deadline, seq, key = self._heap[0]
+            current = self._pending.get(key)
+            if current is None or current[0] != seq:
+                heapq.heappop(self._heap)  # 已被替换或取消
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout > 0:
+                self._cond.wait(timeout)
+                continue
+            heapq.heappop(self._heap)
+            del self._pending[key]
+            return key, current[1]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, callback = self._next_due()
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"防抖回调执行失败 ({key}): {str(e)}")
@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class Dispatcher:
+    """
+    UI 自动化调用的唯一执行线程（wx.SendMsg、截图、拉取消息等都不能并发执行）
+    每个聊天的任务严格按提交顺序执行，聊天之间按优先级轮流；
+    发送消息受每分钟条数限制（达到上限时只暂停发送，拉取消息等 UI 操作不受影响）
+    """
+
+    PRIORITY_INTERACTIVE = 0  # 回复用户
+    PRIORITY_UI = 1  # 拉取消息、截图、添加监听
+    PRIORITY_PROACTIVE = 2  # 主动消息
+
+    def __init__(self, logger, config, send_fn):
+        self.logger = logger
+        self.rate_per_minute = config["SEND_RATE_PER_MINUTE"]
+        self.send_fn = send_fn  # send_fn(text, chat)，在调度线程中执行
+        self._cond = threading.Condition()
+        self._chats = {}  # 聊天 -> deque[(priority, func, future, is_send)]
+        self._ready = []  # (priority, seq, 聊天)
+        self._counter = itertools.count()
+        self._send_times = deque()  # 最近一分钟内的发送时间
+        self._thread = None
+        self.stats = {"sent": 0, "calls": 0, "throttled": 0}
+
+    def send(self, chat, text, priority=PRIORITY_INTERACTIVE):
+        """提交一条消息，返回 concurrent.futures.Future"""
+        return self._submit(chat, lambda: self.send_fn(text, chat), priority, is_send=True)
+
+    def call(self, func, *args, chat=None, priority=PRIORITY_UI):
+        """提交任意 UI 操作，返回 Future；指定 chat 时与该聊天的消息保持顺序"""
+        return self._submit(chat, lambda: func(*args), priority, is_send=False)
+
+    def run(self, func, *args, chat=None, priority=PRIORITY_UI):
+        """提交并等待 UI 操作完成（不能在调度线程中调用）"""
+        return self.call(func, *args, chat=chat, priority=priority).result()
+
+    def pending(self):
+        with self._cond:
+            return sum(len(jobs) for jobs in self._chats.values())
+
+    def _submit(self, chat, func, priority, is_send):
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ui-dispatcher", daemon=True)
+                self._thread.start()
+            jobs = self._chats.setdefault(chat, deque())
+            jobs.append((priority, func, future, is_send))
+            # 同一聊天可能有多个堆条目，取出时队列为空的条目直接跳过
+            heapq.heappush(self._ready, (priority, next(self._counter), chat))
+            self._cond.notify()
+        return future
+
+    def _send_quota(self, now):
+        """最近一分钟内还能发送的条数，SEND_RATE_PER_MINUTE <= 0 表示不限制"""
+        if self.rate_per_minute <= 0:
+            return float("inf")
+        while self._send_times and now - self._send_times[0] >= 60:
+            self._send_times.popleft()
+        return self.rate_per_minute - len(self._send_times)
+
+    def _next_job(self):
+        """
+        在锁内取出下一个要执行的任务
+        发送额度用完时跳过队首是发送的聊天，其余 UI 操作照常执行，额度恢复或有新任务时再取
+        """
+        while True:
+            now = time.monotonic()
+            quota = self._send_quota(now)
+            skipped = []
+            found = False
+            while self._ready:
+                entry = heapq.heappop(self._ready)
+                jobs = self._chats.get(entry[2])
+                if not jobs:
+                    continue
+                if jobs[0][3] and quota <= 0:
+                    skipped.append(entry)
+                    continue
+                chat = entry[2]
+                found = True
+                break
+            for entry in skipped:
+                heapq.heappush(self._ready, entry)
+            if not found:
+                if skipped:
+                    self.stats["throttled"] += 1
+                    self._cond.wait(60 - (now - self._send_times[0]))
+                else:
+                    self._cond.wait()
+                continue
+
+            job = jobs.popleft()
+            if job[3] and self.rate_per_minute > 0:
+                self._send_times.append(now)  # 取出时就占用额度
+            if jobs:
+                heapq.heappush(self._ready, (jobs[0][0], next(self._counter), chat))
+            else:
+                del self._chats[chat]
+            return chat, job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                chat, (_, func, future, is_send) = self._next_job()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func())
+                self.stats["sent" if is_send else "calls"] += 1
+            except BaseException as e:
+                self.logger.error(f"UI操作失败 ({chat}): {str(e)}")
+                future.set_exception(e)
@@ -0,0 +1,143 @@
+import heapq
+import json
+import random
+import threading
+import time
+
+from model.Transport import Transport, TransportError
+
+WORDS = ["今天", "作业", "考试", "老师", "周末", "电影", "晚饭", "图书馆", "论文", "天气", "跑步", "奶茶",
+         "怎么办", "为什么", "可以吗", "好累", "哈哈", "明天", "复习", "题目"]
+
+
+class FakeMessage:
+    def __init__(self, sender, content, type="friend"):
+        self.type = type
+        self.sender = sender
+        self.content = content
+
+    def __repr__(self):
+        return f"FakeMessage({self.sender}: {self.content})"
+
+
+class FakeTransport(Transport):
+    """
+    离线聊天通道：不需要微信客户端，用于回放和压测
+    按 FAKE_MESSAGE_RATE（每个聊天每分钟条数，泊松到达）生成合成消息，
+    或按 FAKE_REPLAY_FILE 回放录制的消息（jsonl，每行 {"time": 秒, "chat": 聊天, "content": 内容}）；
+    记录每条回复相对该聊天最早一条未回复消息的延迟；
+    FAKE_FAILURE_RATE 为每次拉取模拟通道故障的概率：随机丢失一部分监听，偶尔整个客户端断开，
+    未监听期间到达的消息会丢失（与真实客户端一致）
+    """
+
+    def __init__(self, logger, config):
+        self.logger = logger
+        self.rate = config["FAKE_MESSAGE_RATE"] / 60
+        self.duration = config["FAKE_DURATION"]  # 秒，0 表示不停止
+        self.replay_file = config["FAKE_REPLAY_FILE"]
+        self.failure_rate = config["FAKE_FAILURE_RATE"]
+        self.random = random.Random(config["FAKE_SEED"])
+        self.chats = set()  # 正在监听的聊天
+        self._generating = set()  # 已开始生成合成消息的聊天
+        self._due = []  # (到达时间, 序号, 聊天, 内容)
+        self._seq = 0
+        self._started = None
+        self._lock = threading.Lock()
+        self._unanswered = {}  # 聊天 -> 最早一条未回复消息的到达时间
+        self.latencies = []
+        self.stats = {"received": 0, "sent": 0, "screenshots": 0, "failures": 0, "lost": 0}
+
+    def connect(self):
+        self.connected = True
+        if self._started is not None:
+            return
+        self._started = time.monotonic()
+        if self.replay_file:
+            self._load_replay()
+        self.logger.info(f"离线聊天通道已启动: {'回放 ' + self.replay_file if self.replay_file else '合成消息'}")
+
+    def disconnect(self):
+        self.connected = False
+        self.chats.clear()
+
+    def listening(self):
+        return set(self.chats)
+
+    def _push(self, due, chat, content):
+        heapq.heappush(self._due, (due, self._seq, chat, content))
+        self._seq += 1
+
+    def _load_replay(self):
+        with open(self.replay_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    self._push(self._started + float(item["time"]), item["chat"], item["content"])
+
+    def _next_arrival(self, chat, after):
+        if self.rate > 0:
+            self._push(after + self.random.expovariate(self.rate), chat, None)
+
+    def add_listen_chat(self, chat):
+        if chat in self.chats:
+            return
+        self.chats.add(chat)
+        if not self.replay_file and chat not in self._generating:
+            self._generating.add(chat)
+            self._next_arrival(chat, self._started or time.monotonic())
+
+    def _inject_failure(self):
+        self.stats["failures"] += 1
+        if self.random.random() < 0.2:
+            self.disconnect()
+            raise TransportError("模拟客户端断开")
+        lost = {chat for chat in self.chats if self.random.random() < 0.5}
+        self.chats -= lost
+        raise TransportError(f"模拟丢失 {len(lost)} 个监听")
+
+    def get_listen_messages(self):
+        if not self.connected:
+            raise TransportError("未连接")
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self._inject_failure()
+        now = time.monotonic()
+        end = self._started + self.duration if self.duration else None
+        msgs = {}
+        while self._due and self._due[0][0] <= now:
+            due, _, chat, content = heapq.heappop(self._due)
+            if end is not None and due > end:
+                self._due.clear()
+                break
+            if content is None:
+                content = "".join(self.random.choice(WORDS) for _ in range(self.random.randint(2, 8)))
+                self._next_arrival(chat, due)
+            if chat not in self.chats:
+                self.stats["lost"] += 1
+                continue
+            msgs.setdefault(chat, []).append(FakeMessage(chat, content))
+            with self._lock:
+                self.stats["received"] += 1
+                self._unanswered.setdefault(chat, due)
+        return msgs
+
+    def send(self, text, chat):
+        now = time.monotonic()
+        with self._lock:
+            self.stats["sent"] += 1
+            arrived = self._unanswered.pop(chat, None)
+            if arrived is not None:
+                self.latencies.append(now - arrived)
+
+    def screenshot(self, chat, path):
+        self.stats["screenshots"] += 1
+        return None
+
+    def finished(self):
+        """回放/生成已结束且所有消息都已回复"""
+        with self._lock:
+            return not self._due and not self._unanswered
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "replied": len(self.latencies), "unanswered": len(self._unanswered),
+                    "latencies": list(self.latencies)}
@@ -0,0 +1,86 @@
+import io
+import os
+
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+}
+
+
+def load_pillow():
+    """Pillow 导入较慢，第一次处理图片时才导入；没有安装时返回 None"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def prepare_image(image_path, is_emoji, config, logger):
+    """
+    上传视觉接口前的预处理：表情包截图裁剪到最近一条消息所在区域，
+    缩放到 IMAGE_MAX_EDGE 以内，再按 IMAGE_FORMAT/IMAGE_QUALITY 重新编码
+    返回 (图片字节, MIME 类型)
+    """
+    with open(image_path, 'rb') as f:
+        raw = f.read()
+    raw_mime = MIME_TYPES.get(os.path.splitext(image_path)[1].lower(), 'image/png')
+    Image = load_pillow()
+    if Image is None:  # 没有 Pillow 时原样上传
+        return raw, raw_mime
+
+    try:
+        with Image.open(io.BytesIO(raw)) as img:
+            img.seek(0)  # 动图只取第一帧
+            img = img.copy()
+
+        if is_emoji:
+            img = crop_latest_message(img, config)
+
+        max_edge = config["IMAGE_MAX_EDGE"]
+        if max(img.size) > max_edge:
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        fmt = config["IMAGE_FORMAT"].upper()
+        if fmt == "JPEG" and img.mode != "RGB":
+            img = flatten(img)
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt, quality=config["IMAGE_QUALITY"])
+        data = buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"图片预处理失败，使用原图上传: {image_path}, {str(e)}")
+        return raw, raw_mime
+
+    if len(data) >= len(raw) and not is_emoji:
+        logger.info(f"图片预处理未减小体积，使用原图: {len(raw)} 字节")
+        return raw, raw_mime
+
+    logger.info(f"图片预处理: {len(raw)} -> {len(data)} 字节，节省 {len(raw) - len(data)} 字节")
+    return data, f"image/{fmt.lower()}"
+
+
+def crop_latest_message(img, config):
+    """按比例裁掉聊天窗口的标题栏、输入框和较早的消息，只保留最近一条消息附近"""
+    width, height = img.size
+    top = int(height * config["EMOJI_CROP_TOP"])
+    bottom = int(height * config["EMOJI_CROP_BOTTOM"])
+    if bottom - top < 16:
+        return img
+    return img.crop((0, top, width, bottom))
+
+
+def flatten(img):
+    """JPEG 不支持透明通道，铺到白色背景上"""
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = load_pillow().new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    return img.convert("RGB")
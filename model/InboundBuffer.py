@@ -0,0 +1,133 @@
+import time
+
+
+class InboundBuffer:
+    """
+    单个聊天待回复消息的环形缓冲区，容量固定为 INBOUND_CAPACITY 条
+    满了之后合并最早的两条（优先合并相邻的文本）而不是丢弃；
+    缓冲的文本超过 INBOUND_MAX_BYTES 时，把最长的一条压缩为保留开头和结尾的摘要
+    槽位在第一条消息到达时才分配，取出后复用；调用方需持有 user.queue_lock
+    """
+
+    __slots__ = ("capacity", "max_bytes", "_slots", "_head", "_size", "bytes", "first_time", "last_time",
+                 "total_messages", "total_bytes", "merged", "summarized")
+
+    def __init__(self, capacity, max_bytes):
+        self.capacity = max(2, capacity)  # 满了要合并最早的两条，至少需要两个槽位
+        self.max_bytes = max_bytes
+        self._slots = None  # 每个槽位是一条文本、一个图片识别任务，或合并后的列表
+        self._head = 0
+        self._size = 0
+        self.bytes = 0  # 当前缓冲的文本字节数
+        self.first_time = 0  # 当前这批消息中第一条/最后一条的到达时间
+        self.last_time = 0
+        self.total_messages = 0
+        self.total_bytes = 0
+        self.merged = 0  # 因缓冲区满而合并的次数
+        self.summarized = 0  # 因超出字节上限而压缩的次数
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def size_of(item):
+        if isinstance(item, str):
+            return len(item.encode("utf-8"))
+        if isinstance(item, list):
+            return sum(InboundBuffer.size_of(part) for part in item)
+        return 0
+
+    def _index(self, i):
+        return (self._head + i) % self.capacity
+
+    def push(self, item, now=None):
+        """加入一条消息，缓冲区已满需要合并时返回 True"""
+        now = time.time() if now is None else now
+        if self._slots is None:
+            self._slots = [None] * self.capacity
+        if self._size == 0:
+            self.first_time = now
+        self.last_time = now
+        size = self.size_of(item)
+        self.total_messages += 1
+        self.total_bytes += size
+
+        coalesced = self._size == self.capacity
+        if coalesced:
+            self._coalesce()
+        self._slots[self._index(self._size)] = item
+        self._size += 1
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._summarize():
+            pass
+        return coalesced
+
+    def _coalesce(self):
+        """合并最早的相邻文本；没有相邻文本时把最早的两个槽位合并为列表"""
+        slots = [self._slots[self._index(i)] for i in range(self._size)]
+        for i in range(self._size - 1):
+            if isinstance(slots[i], str) and isinstance(slots[i + 1], str):
+                slots[i:i + 2] = [f"{slots[i]} {slots[i + 1]}"]
+                self.bytes += 1
+                break
+        else:
+            first = slots[0] if isinstance(slots[0], list) else [slots[0]]
+            second = slots[1] if isinstance(slots[1], list) else [slots[1]]
+            slots[0:2] = [first + second]
+        self.merged += 1
+        self._reset(slots)
+
+    def _summarize(self):
+        """压缩字节数最多的一条文本，无法再缩短时返回 False"""
+        longest, length = None, 0
+        for i in range(self._size):
+            item = self._slots[self._index(i)]
+            if isinstance(item, str) and self.size_of(item) > length:
+                longest, length = i, self.size_of(item)
+        if longest is None:
+            return False
+        text = self._slots[self._index(longest)]
+        excess = self.bytes - self.max_bytes
+        keep = max(20, int(len(text) * (1 - excess / length)) - 12)
+        if keep >= len(text) - 12:
+            return False
+        head = keep // 2
+        summary = f"{text[:head]}…(省略{len(text) - keep}字)…{text[len(text) - (keep - head):]}"
+        self.bytes += self.size_of(summary) - self.size_of(text)
+        self._slots[self._index(longest)] = summary
+        self.summarized += 1
+        return True
+
+    def _reset(self, items):
+        self._slots = items + [None] * (self.capacity - len(items))
+        self._head = 0
+        self._size = len(items)
+
+    def items(self):
+        """按到达顺序返回缓冲的消息（合并的列表会展开），不取出"""
+        result = []
+        for i in range(self._size):
+            item = self._slots[self._index(i)]
+            if isinstance(item, list):
+                result.extend(item)
+            else:
+                result.append(item)
+        return result
+
+    def drain(self):
+        """取出所有消息并清空，槽位保留复用"""
+        result = self.items()
+        for i in range(self._size):
+            self._slots[self._index(i)] = None
+        self._head = 0
+        self._size = 0
+        self.bytes = 0
+        return result
+
+    def restore(self, items, last_time):
+        for item in items:
+            self.push(item, now=last_time)
+
+    def get_stats(self):
+        return {"buffered": self._size, "bytes": self.bytes, "messages": self.total_messages,
+                "total_bytes": self.total_bytes, "merged": self.merged, "summarized": self.summarized}
@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+
+class ListenerSupervisor:
+    """
+    监听通道的故障恢复：只有通道故障才进入恢复，单条消息的错误不影响连接；
+    恢复按带抖动的指数退避进行，客户端仍可用时不重新连接，只重新订阅丢失监听的聊天
+    """
+
+    def __init__(self, logger, config, transport, dispatcher, metrics):
+        self.logger = logger
+        self.transport = transport
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.backoff_base = config["LISTENER_BACKOFF_BASE"]
+        self.backoff_max = config["LISTENER_BACKOFF_MAX"]
+        self.failures = 0  # 本次故障以来连续失败次数
+        self.down_since = None  # 本次故障开始时间，None 表示正常
+        self.next_attempt = 0
+        self._lock = threading.Lock()
+        self.stats = {"failures": 0, "recoveries": 0, "reconnects": 0, "resubscribed": 0,
+                      "last_recovery_seconds": 0.0}
+
+    def fail(self, error):
+        """记录一次通道故障，安排下一次恢复时间（可在任意线程调用）"""
+        with self._lock:
+            now = time.monotonic()
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.down_since is None:
+                self.down_since = now
+            delay = min(self.backoff_base * 2 ** (self.failures - 1), self.backoff_max)
+            delay *= random.uniform(1.0, 1.5)
+            self.next_attempt = now + delay
+        self.metrics.inc("wxbot_listener_failures_total")
+        self.logger.warning(f"监听通道异常，{delay:.1f}s 后尝试恢复: {str(error)}")
+
+    def wait(self):
+        """距离下一次恢复尝试的秒数"""
+        return max(0.0, self.next_attempt - time.monotonic())
+
+    def recover(self, chats):
+        """通道正常或恢复成功时返回 True；还在退避中或恢复失败返回 False"""
+        with self._lock:
+            down_since = self.down_since
+            if down_since is None:
+                return True
+            if time.monotonic() < self.next_attempt:
+                return False
+        try:
+            if not self.dispatcher.run(self.transport.alive):
+                self.logger.info("尝试重新连接微信...")
+                self.dispatcher.run(self.transport.disconnect)
+                self.dispatcher.run(self.transport.connect)
+                self.stats["reconnects"] += 1
+                self.logger.info("微信连接成功")
+            listening = self.dispatcher.run(self.transport.listening)
+            missing = [chat for chat in chats if chat not in listening]
+            for chat in missing:
+                self.dispatcher.run(self.transport.add_listen_chat, chat)
+        except Exception as e:
+            self.fail(e)
+            return False
+
+        elapsed = time.monotonic() - down_since
+        with self._lock:
+            self.failures = 0
+            self.down_since = None
+        self.stats["recoveries"] += 1
+        self.stats["resubscribed"] += len(missing)
+        self.stats["last_recovery_seconds"] = round(elapsed, 3)
+        self.metrics.observe("wxbot_listener_recovery_seconds", elapsed)
+        self.logger.info(f"监听已恢复，用时 {elapsed:.1f}s，重新订阅 {len(missing)}/{len(chats)} 个聊天")
+        return True
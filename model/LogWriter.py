@@ -0,0 +1,125 @@
+import atexit
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+
+class LogWriter:
+    """
+    进程内唯一的记忆日志写入线程
+    调用方只把日志行放入队列，写入线程按条数或时间批量提交，并按大小轮转
+    """
+
+    _STOP = object()
+
+    def __init__(self, logger, config):
+        self.logger = logger
+        self.max_bytes = config["LOG_MAX_BYTES"]
+        self.batch_size = config["LOG_BATCH_SIZE"]
+        self.flush_interval = config["LOG_FLUSH_INTERVAL"]
+        self._queue = queue.Queue()
+        self._sizes = {}  # 文件路径 -> 当前大小，避免每次写入都 stat
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.stats = {"lines": 0, "batches": 0, "rotations": 0}
+        atexit.register(self.close)
+
+    def write(self, path, line):
+        """追加一行日志（不阻塞调用方）"""
+        if self._thread is None:
+            self._start()
+        self._queue.put((path, line))
+
+    def pending(self):
+        """尚未写入的日志行数"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=None):
+        """等待此前写入的日志全部落盘"""
+        if self._thread is None:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """退出前调用：写完队列中剩余的日志并结束写入线程"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        thread.join()
+        self._thread = None
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            # 达到批量大小、超时、flush 或退出时统一提交
+            self._commit(batch)
+            batch, deadline = [], None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is self._STOP:
+                return
+
+    def _commit(self, batch):
+        if not batch:
+            return
+        grouped = {}
+        for path, line in batch:
+            grouped.setdefault(path, []).append(line)
+        for path, lines in grouped.items():
+            try:
+                self._append(path, "".join(lines))
+            except Exception as e:
+                self.logger.error(f"写入日志失败: {path}, {str(e)}")
+        self.stats["lines"] += len(batch)
+        self.stats["batches"] += 1
+
+    def _append(self, path, data):
+        size = self._sizes.get(path)
+        if size is None:
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size > self.max_bytes:
+            self._rotate(path)
+            size = 0
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(data)
+        self._sizes[path] = size + len(data.encode('utf-8'))
+
+    def _rotate(self, path):
+        """归档为 <原文件名>_archive_<时间>_<序号>.txt，同一秒内多次轮转也不会重名"""
+        base = os.path.splitext(path)[0]
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        seq = 0
+        while True:
+            archive = f"{base}_archive_{stamp}_{seq}.txt"
+            if not os.path.exists(archive):
+                break
+            seq += 1
+        shutil.move(path, archive)
+        self.stats["rotations"] += 1
+        self.logger.info(f"日志已归档: {archive}")
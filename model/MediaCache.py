@@ -0,0 +1,176 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from model.ImagePrep import load_pillow
+
+
+class MediaFingerprint:
+    """一张图片的指纹：内容哈希 + 可选的感知哈希（dHash）"""
+
+    def __init__(self, digest, kind, phash=None):
+        self.digest = digest
+        self.kind = kind  # "image" 或 "emoji"，两者识别提示词不同，分开缓存
+        self.phash = phash
+
+    @property
+    def key(self):
+        return f"{self.kind}:{self.digest}"
+
+
+class MediaCache:
+    """
+    图片识别结果缓存
+    内存 LRU + SQLite 磁盘层（重启后仍有效），按内容哈希命中，
+    重新编码过的相同图片通过感知哈希的汉明距离命中；
+    表情包只有聊天窗口截图，同一个表情的截图也几乎不会重复，不缓存
+    """
+
+    def __init__(self, logger, config, db_path):
+        self.logger = logger
+        self.memory_items = config["MEDIA_CACHE_MEMORY_ITEMS"]
+        self.disk_bytes = config["MEDIA_CACHE_DISK_BYTES"]
+        self.phash_distance = config["MEDIA_CACHE_PHASH_DISTANCE"]
+        self.db_path = db_path
+        self._memory = OrderedDict()  # key -> text
+        self._phashes = {}  # kind -> {key: phash}
+        self._lock = threading.Lock()
+        self._db = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "phash_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _connect(self):
+        if self._db is not None:
+            return self._db
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media_cache ("
+            "key TEXT PRIMARY KEY, kind TEXT, phash INTEGER, text TEXT, size INTEGER, last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS media_cache_last_used ON media_cache (last_used)")
+        for key, kind, phash in self._db.execute("SELECT key, kind, phash FROM media_cache WHERE phash IS NOT NULL"):
+            self._phashes.setdefault(kind, {})[key] = phash & 0xFFFFFFFFFFFFFFFF
+        self._db.commit()
+        return self._db
+
+    def fingerprint(self, image_path):
+        with open(image_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return MediaFingerprint(digest, "image", self._dhash(image_path))
+
+    @staticmethod
+    def _dhash(image_path, size=8):
+        """差值哈希：缩放到 9x8 灰度图，比较相邻像素得到 64 位指纹"""
+        Image = load_pillow()
+        if Image is None:  # 没有 Pillow 时只使用内容哈希
+            return None
+        try:
+            with Image.open(image_path) as img:
+                pixels = list(img.convert("L").resize((size + 1, size)).getdata())
+        except Exception:
+            return None
+        value = 0
+        for row in range(size):
+            for col in range(size):
+                left = pixels[row * (size + 1) + col]
+                right = pixels[row * (size + 1) + col + 1]
+                value = (value << 1) | (left > right)
+        return value
+
+    def get(self, fp):
+        """按内容哈希、感知哈希依次查找，未命中返回 None"""
+        with self._lock:
+            text = self._memory.get(fp.key)
+            if text is not None:
+                self._memory.move_to_end(fp.key)
+                self.stats["memory_hits"] += 1
+                return text
+
+            db = self._connect()
+            key = fp.key
+            row = db.execute("SELECT text FROM media_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.stats["disk_hits"] += 1
+            elif fp.phash is not None:
+                key = self._nearest(fp)
+                if key is not None:
+                    row = db.execute("SELECT text FROM media_cache WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        self.stats["phash_hits"] += 1
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+
+            db.execute("UPDATE media_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+            self._remember(fp.key, row[0])
+            return row[0]
+
+    def put(self, fp, text):
+        if not text:
+            return
+        with self._lock:
+            db = self._connect()
+            phash = fp.phash
+            db.execute(
+                "INSERT OR REPLACE INTO media_cache (key, kind, phash, text, size, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (fp.key, fp.kind, self._to_signed(phash), text, len(text.encode('utf-8')), time.time())
+            )
+            if phash is not None:
+                self._phashes.setdefault(fp.kind, {})[fp.key] = phash
+            self._evict(db)
+            db.commit()
+            self._remember(fp.key, text)
+            self.stats["stores"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        hits = stats["memory_hits"] + stats["disk_hits"] + stats["phash_hits"]
+        total = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / total, 3) if total else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _nearest(self, fp):
+        best_key, best_distance = None, self.phash_distance + 1
+        for key, phash in self._phashes.get(fp.kind, {}).items():
+            distance = bin(phash ^ fp.phash).count("1")
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    def _evict(self, db):
+        """磁盘层超过容量时按最近使用时间淘汰"""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM media_cache").fetchone()[0]
+        if total <= self.disk_bytes:
+            return
+        for key, kind, size in db.execute("SELECT key, kind, size FROM media_cache ORDER BY last_used").fetchall():
+            if total <= self.disk_bytes:
+                break
+            db.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+            self._phashes.get(kind, {}).pop(key, None)
+            self._memory.pop(key, None)
+            total -= size
+            self.stats["evictions"] += 1
+
+    @staticmethod
+    def _to_signed(phash):
+        # SQLite INTEGER 为有符号 64 位
+        if phash is None:
+            return None
+        return phash - (1 << 64) if phash >= (1 << 63) else phash
@@ -0,0 +1,160 @@
+import math
+import os
+import re
+import threading
+import time
+
+from model.ChatContext import estimate_tokens
+
+LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| \[(User|AI)\] (.*)$')
+FILE_PATTERN = re.compile(r'^(.+)_(?:User|AI)_log(?:_archive_.+)?\.txt$')
+WORD_PATTERN = re.compile(r'[a-z0-9]+|[\u2e80-\u9fff\uac00-\ud7af]+')
+
+
+def tokenize(text):
+    """英文/数字按单词切分，中日韩文字按相邻两字切分"""
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word[0].isascii():
+            terms.append(word)
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+
+class OwnerIndex:
+    """单个聊天（name_prompt）的倒排索引"""
+
+    def __init__(self):
+        self.docs = []  # (时间, 角色, 内容)
+        self.lengths = []
+        self.postings = {}  # term -> {doc_id: tf}
+        self.total_length = 0
+        self.seen = set()  # 日志轮转后归档文件与原文件内容重复，按行去重
+
+    def add(self, timestamp, role, content):
+        key = hash((timestamp, role, content))
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        doc_id = len(self.docs)
+        terms = tokenize(content)
+        self.docs.append((timestamp, role, content))
+        self.lengths.append(len(terms))
+        self.total_length += len(terms)
+        for term in terms:
+            tf = self.postings.setdefault(term, {})
+            tf[doc_id] = tf.get(doc_id, 0) + 1
+        return True
+
+
+class MemoryIndex:
+    """
+    长期记忆检索：增量读取记忆目录下的聊天日志和归档，建立 BM25 索引，
+    每轮对话按相关度取出 top-k 历史片段，并控制在 MEMORY_TOKEN_BUDGET 内
+    """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, logger, config, memory_dir):
+        self.logger = logger
+        self.memory_dir = memory_dir
+        self.top_k = config["MEMORY_TOP_K"]
+        self.token_budget = config["MEMORY_TOKEN_BUDGET"]
+        self.refresh_interval = config["MEMORY_REFRESH_INTERVAL"]
+        self._offsets = {}  # 文件路径 -> 已读取的字节数
+        self._owners = {}  # name_prompt -> OwnerIndex
+        self._lock = threading.Lock()
+        self._last_refresh = 0
+
+    def refresh(self, force=False):
+        """读取日志文件新增的部分，返回新增的条数"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_refresh < self.refresh_interval:
+                return 0
+            self._last_refresh = now
+            if not os.path.isdir(self.memory_dir):
+                return 0
+            added = 0
+            for entry in os.scandir(self.memory_dir):
+                match = FILE_PATTERN.match(entry.name)
+                if match is None or not entry.is_file():
+                    continue
+                added += self._ingest(entry.path, match.group(1), entry.stat().st_size)
+            return added
+
+    def _ingest(self, path, owner, size):
+        offset = self._offsets.get(path, 0)
+        if size < offset:
+            offset = 0  # 文件被轮转后重新创建
+        if size == offset:
+            return 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size - offset)
+        end = data.rfind(b'\n')
+        if end < 0:
+            return 0  # 最后一行还没写完整
+        self._offsets[path] = offset + end + 1
+
+        index = self._owners.setdefault(owner, OwnerIndex())
+        added = 0
+        for line in data[:end].decode('utf-8', errors='ignore').splitlines():
+            match = LINE_PATTERN.match(line)
+            if match and index.add(*match.groups()):
+                added += 1
+        return added
+
+    def search(self, owner, query, exclude=()):
+        """返回与 query 最相关的 top-k 条历史记录，按时间排序"""
+        with self._lock:
+            index = self._owners.get(owner)
+            if index is None or not index.docs:
+                return []
+            n = len(index.docs)
+            avg_length = index.total_length / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = index.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = tf + self.K1 * (1 - self.B + self.B * index.lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0) + idf * tf * (self.K1 + 1) / norm
+            ranked = sorted(scores, key=scores.get, reverse=True)
+
+            results, used = [], 0
+            for doc_id in ranked:
+                timestamp, role, content = index.docs[doc_id]
+                if any(content in text for text in exclude):
+                    continue  # 已在当前上下文中
+                tokens = estimate_tokens(content) + 8
+                if used + tokens > self.token_budget:
+                    continue
+                results.append(index.docs[doc_id])
+                used += tokens
+                if len(results) >= self.top_k:
+                    break
+            return sorted(results)
+
+    def recall(self, user, query, exclude=()):
+        """为 user 检索相关历史并格式化为提示文本，没有结果时返回空字符串"""
+        self.refresh()
+        docs = self.search(f"{user.name}_{user.prompt_name}", query, exclude=exclude)
+        if not docs:
+            return ""
+        return "\n".join(f"[{timestamp}] {'用户' if role == 'User' else '你'}: {content}"
+                         for timestamp, role, content in docs)
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "owners": len(self._owners),
+                "docs": sum(len(index.docs) for index in self._owners.values()),
+                "files": len(self._offsets),
+            }
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+
+class Histogram:
+    """固定桶计数（Prometheus histogram）+ 最近样本（计算 p50/p95/p99）"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.samples = deque(maxlen=1024)
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+
+
+def quantile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """
+    各处理阶段的耗时、队列深度和错误计数，导出为 Prometheus 文本格式
+    耗时按 (阶段, 聊天) 记录直方图，另按阶段汇总 p50/p95/p99
+    """
+
+    STAGE_METRIC = "wxbot_stage_seconds"
+
+    def __init__(self, logger):
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # (name, labels) -> value
+        self._collectors = []  # 导出时调用，返回 [(类型, 名称, 标签dict, 值)]
+        self._server = None
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def stage(self, stage, seconds, chat=None):
+        """记录一个阶段的耗时"""
+        if chat is None:
+            self.observe(self.STAGE_METRIC, seconds, stage=stage)
+        else:
+            self.observe(self.STAGE_METRIC, seconds, stage=stage, chat=chat)
+
+    @contextmanager
+    def span(self, stage, chat=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(stage, time.perf_counter() - start, chat)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def stage_quantiles(self):
+        """按阶段汇总（不区分聊天）的 p50/p95/p99"""
+        samples = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                if name == self.STAGE_METRIC:
+                    samples.setdefault(dict(labels)["stage"], []).extend(histogram.samples)
+        return {stage: {q: quantile(values, q) for q in (0.5, 0.95, 0.99)} for stage, values in samples.items()}
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = {key: (list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        for collector in self._collectors:
+            try:
+                for kind, name, labels, value in collector():
+                    target = counters if kind == "counter" else gauges
+                    target[(name, tuple(sorted(labels.items())))] = value
+            except Exception as e:
+                self.logger.warning(f"指标采集失败: {str(e)}")
+
+        typed = set()
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        lines.append("# TYPE wxbot_stage_quantile_seconds gauge")
+        for stage, values in sorted(self.stage_quantiles().items()):
+            for q, value in values.items():
+                lines.append(f"wxbot_stage_quantile_seconds{format_labels((('quantile', q), ('stage', stage)))} {value}")
+
+        for kind, metrics in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in sorted(metrics.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        """原子写入，避免采集方读到一半的文件"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def start_exporter(self, path=None, port=0, interval=15):
+        """定期写入指标文件，并可选在本地端口提供 /metrics"""
+        if path:
+            def run():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.write_file(path)
+                    except Exception as e:
+                        self.logger.warning(f"写入指标文件失败: {str(e)}")
+
+            threading.Thread(target=run, name="metrics-file", daemon=True).start()
+
+        if port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # 只在开启 HTTP 导出时导入
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip("/") not in ("", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+            self.logger.info(f"指标地址: http://127.0.0.1:{port}/metrics")
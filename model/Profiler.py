@@ -0,0 +1,63 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    采样分析器：定时抓取目标线程的调用栈并计数，
+    输出 collapsed stack 格式（可直接用 flamegraph.pl / speedscope 查看）
+    """
+
+    def __init__(self, logger, thread, interval=0.01, output=None, dump_interval=60):
+        self.logger = logger
+        self.thread = thread
+        self.interval = interval
+        self.output = output
+        self.dump_interval = dump_interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="sampling-profiler", daemon=True).start()
+        self.logger.info(f"采样分析已启动: 线程 {self.thread.name}, 间隔 {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+        self.dump()
+
+    def _run(self):
+        last_dump = time.monotonic()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread.ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            with self._lock:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+            if self.output and time.monotonic() - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = time.monotonic()
+
+    def top(self, n=10):
+        with self._lock:
+            return self.stacks.most_common(n)
+
+    def dump(self):
+        if not self.output:
+            return
+        with self._lock:
+            lines = [f"{stack} {count}" for stack, count in self.stacks.items()]
+        tmp_path = f"{self.output}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.output)
@@ -0,0 +1,120 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, now):
+        """还需等待多少秒才能取出 amount 个令牌"""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 超过桶容量的请求等到桶满即可放行
+        return 0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderLimit:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiters = []  # (priority, seq, future, tokens)
+        self.blocked_until = 0  # 服务商返回 429 后暂停到此时间
+        self.failures = 0  # 连续被限流次数，用于退避
+        self.timer = None
+
+
+class RateLimiter:
+    """
+    上游接口限流：每个服务商独立的请求数(RPM)和token数(TPM)令牌桶，
+    排队的请求按优先级放行（用户回复优先于后台摘要和主动消息），
+    收到 429 时按 Retry-After 或带抖动的指数退避暂停该服务商
+    只能在发送线程的事件循环中使用
+    """
+
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BACKGROUND = 1
+    PRIORITY_PROACTIVE = 2
+
+    def __init__(self, logger, config):
+        self.logger = logger
+        self.limits_config = config["RATE_LIMITS"]
+        self.backoff_base = config["RATE_LIMIT_BACKOFF_BASE"]
+        self.backoff_max = config["RATE_LIMIT_BACKOFF_MAX"]
+        self._providers = {}
+        self._counter = itertools.count()
+        self.stats = {"acquired": 0, "waited": 0, "rate_limited": 0}
+
+    def _limit(self, provider):
+        limit = self._providers.get(provider)
+        if limit is None:
+            settings = self.limits_config.get(provider) or self.limits_config["default"]
+            limit = ProviderLimit(settings["rpm"], settings["tpm"])
+            self._providers[provider] = limit
+        return limit
+
+    async def acquire(self, provider, tokens, priority=PRIORITY_INTERACTIVE):
+        """等待直到 provider 有足够的请求和token额度"""
+        limit = self._limit(provider)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(limit.waiters, (priority, next(self._counter), future, tokens))
+        self._dispatch(provider)
+        if not future.done():
+            self.stats["waited"] += 1
+        await future
+        self.stats["acquired"] += 1
+
+    def blocked(self, provider):
+        limit = self._providers.get(provider)
+        return limit is not None and limit.blocked_until > time.monotonic()
+
+    def penalize(self, provider, retry_after=None):
+        """服务商返回 429：优先遵守 Retry-After，否则指数退避，均加随机抖动"""
+        limit = self._limit(provider)
+        limit.failures += 1
+        self.stats["rate_limited"] += 1
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = min(self.backoff_base * 2 ** (limit.failures - 1), self.backoff_max)
+        delay *= random.uniform(1.0, 1.5)
+        limit.blocked_until = max(limit.blocked_until, time.monotonic() + delay)
+        self.logger.warning(f"{provider} 触发限流，暂停 {delay:.1f}s")
+
+    def succeed(self, provider):
+        self._limit(provider).failures = 0
+
+    def _dispatch(self, provider):
+        limit = self._limit(provider)
+        if limit.timer is not None:
+            limit.timer.cancel()
+            limit.timer = None
+        while limit.waiters:
+            _, _, future, tokens = limit.waiters[0]
+            if future.done():  # 等待方已取消
+                heapq.heappop(limit.waiters)
+                continue
+            now = time.monotonic()
+            delay = max(limit.blocked_until - now, limit.requests.delay(1, now), limit.tokens.delay(tokens, now))
+            if delay > 0:
+                loop = asyncio.get_running_loop()
+                limit.timer = loop.call_later(delay, self._dispatch, provider)
+                return
+            heapq.heappop(limit.waiters)
+            limit.requests.take(1)
+            limit.tokens.take(tokens)
+            future.set_result(None)
@@ -0,0 +1,77 @@
+class ReplySegmenter:
+    """
+    流式回复切分器：逐块喂入模型输出，按'\\'切出完整分段
+    以<think>开头的推理内容在</think>出现前一直缓存，随后整体丢弃；
+    没有<think>开头时，第一段产出之前出现的</think>及其之前的内容同样丢弃；
+    出现"## 记忆片段"后不再产出任何分段
+    """
+
+    THINK_OPEN = "<think>"
+    THINK_CLOSE = "</think>"
+    MEMORY_MARK = "## 记忆片段"
+
+    def __init__(self):
+        self.text = ""  # 去掉推理内容后的完整回复
+        self.emitted = 0  # 已产出的分段数
+        self.suppressed = False
+        self._raw = ""
+        self._thinking = None  # None: 还不能确定是否有推理内容
+        self._pending = ""
+
+    def feed(self, chunk):
+        """喂入一块输出，返回此时已经完整的分段"""
+        if self._thinking is not False:
+            self._raw += chunk
+            chunk = self._strip_think()
+            if chunk is None:
+                return []
+        self.text += chunk
+        self._pending += chunk
+        if not self.emitted and self.THINK_CLOSE in self._pending:
+            self._pending = self._pending.split(self.THINK_CLOSE, 1)[1].lstrip()
+            self.text = self._pending
+        if '\\' not in self._pending:
+            return []
+        *parts, self._pending = self._pending.split('\\')
+        return self._emit(parts)
+
+    def flush(self):
+        """输出结束，返回剩余的最后一个分段"""
+        if self._thinking is not False:
+            # 推理内容没有闭合，按原样处理
+            self._thinking = False
+            self.text += self._raw
+            self._pending += self._raw
+            self._raw = ""
+        parts, self._pending = [self._pending], ""
+        return self._emit(parts)
+
+    def _strip_think(self):
+        """确定推理内容的边界前返回 None，确定后返回可以继续处理的文本"""
+        head = self._raw.lstrip()
+        if self._thinking is None:
+            if len(head) < len(self.THINK_OPEN) and self.THINK_OPEN.startswith(head):
+                return None
+            self._thinking = head.startswith(self.THINK_OPEN)
+            if not self._thinking:
+                rest, self._raw = self._raw, ""
+                return rest
+        if self.THINK_CLOSE not in self._raw:
+            return None
+        self._thinking = False
+        rest = self._raw.split(self.THINK_CLOSE, 1)[1].lstrip()
+        self._raw = ""
+        return rest
+
+    def _emit(self, parts):
+        segments = []
+        for part in parts:
+            part = part.strip()
+            if not part or self.suppressed:
+                continue
+            if self.MEMORY_MARK in part:
+                self.suppressed = True
+                continue
+            segments.append(part)
+        self.emitted += len(segments)
+        return segments
@@ -0,0 +1,285 @@
+import asyncio
+import time
+from collections import deque
+
+from model.ChatContext import estimate_tokens
+
+
+class ProviderError(Exception):
+    """服务商返回非200状态"""
+
+    def __init__(self, provider, status, text, retry_after=None):
+        super().__init__(f"{provider} HTTP {status}: {text}")
+        self.provider = provider
+        self.status = status
+        self.retry_after = retry_after
+
+
+class RateLimited(ProviderError):
+    """服务商返回 429"""
+
+
+class Provider:
+    """一个 OpenAI 兼容的服务商，记录延迟分布并维护熔断状态"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, base_url, api_key, model, config):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.failure_threshold = config["CIRCUIT_FAILURE_THRESHOLD"]
+        self.cooldown = config["CIRCUIT_COOLDOWN"]
+        self.latencies = deque(maxlen=200)
+        self.results = deque(maxlen=50)  # 最近请求是否成功
+        self.consecutive_failures = 0
+        self.errors = 0  # 累计失败次数（导出为计数器）
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.trial_in_flight = False
+
+    def available(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        # 半开状态只放行一个试探请求
+        return self.state == self.HALF_OPEN and not self.trial_in_flight
+
+    def begin(self):
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.results.append(True)
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.results.append(False)
+        self.consecutive_failures += 1
+        self.errors += 1
+        self.trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def score(self):
+        """越小越健康：中位延迟按错误率放大，没有样本时视为1秒"""
+        p50 = self.percentile(50) or 1.0
+        error_rate = self.results.count(False) / len(self.results) if self.results else 0
+        return p50 * (1 + 4 * error_rate)
+
+    def headers(self):
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+    def get_stats(self):
+        return {"state": self.state, "p50": self.percentile(50), "p95": self.percentile(95),
+                "requests": len(self.results), "failures": self.results.count(False)}
+
+
+class Router:
+    """
+    多服务商路由：按健康度排序选择服务商，失败时依次回退，熔断连续失败的服务商；
+    开启对冲时，首选服务商超过其 p95 延迟仍未返回就并发请求次选，取先完成的结果
+    """
+
+    def __init__(self, logger, config, session_getter, limiter):
+        self.logger = logger
+        self.get_session = session_getter
+        self.limiter = limiter
+        self.max_retries = config["RATE_LIMIT_MAX_RETRIES"]
+        self.hedge = config["HEDGE_SWITCH"]
+        self.hedge_min_delay = config["HEDGE_MIN_DELAY"]
+        self.first_byte_timeout = config["STREAM_FIRST_BYTE_TIMEOUT"]
+        self.providers = [self._make_provider(item, config) for item in config["LLM_PROVIDERS"]]
+        self.status_counts = {}  # (服务商, HTTP状态码) -> 非200响应次数
+
+    @staticmethod
+    def _make_provider(item, config):
+        """'deepseek'/'moonshot' 使用已有配置，其余写成 {name, base_url, api_key, model}"""
+        if item == "deepseek":
+            return Provider("deepseek", config["DEEPSEEK_BASE_URL"], config["DEEPSEEK_API_KEY"],
+                            config["DEEPSEEK_MODEL"], config)
+        if item == "moonshot":
+            return Provider("moonshot", config["MOONSHOT_BASE_URL"], config["MOONSHOT_API_KEY"],
+                            config["MOONSHOT_TEXT_MODEL"], config)
+        return Provider(item["name"], item["base_url"], item["api_key"], item["model"], config)
+
+    def ranked(self):
+        """可用的服务商，被限流暂停的排在最后"""
+        return sorted((p for p in self.providers if p.available()),
+                      key=lambda p: (self.limiter.blocked(p.name), p.score()))
+
+    @staticmethod
+    def estimate_payload_tokens(payload):
+        return sum(estimate_tokens(message.get("content") or "") for message in payload["messages"])
+
+    async def _open(self, provider, payload, priority):
+        """等待限流额度后发出请求，返回 aiohttp 的请求上下文"""
+        await self.limiter.acquire(provider.name, self.estimate_payload_tokens(payload), priority)
+        provider.begin()
+        return self.get_session().post(
+            f"{provider.base_url}/chat/completions",
+            headers=provider.headers(),
+            json={**payload, "model": provider.model}
+        )
+
+    async def _check(self, provider, response):
+        if response.status != 200:
+            key = (provider.name, response.status)
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+        if response.status == 429:
+            self.limiter.penalize(provider.name, response.headers.get("Retry-After"))
+            raise RateLimited(provider.name, response.status, await response.text())
+        if response.status != 200:
+            raise ProviderError(provider.name, response.status, await response.text(),
+                                response.headers.get("Retry-After"))
+        self.limiter.succeed(provider.name)
+
+    def get_stats(self):
+        return {p.name: p.get_stats() for p in self.providers}
+
+    async def _first_line(self, provider, request):
+        """发出流式请求并读到第一行，返回 (响应, 第一行)；超时被取消时关闭连接"""
+        response = await request
+        try:
+            await self._check(provider, response)
+            return response, await response.content.readline()
+        except BaseException:
+            response.close()
+            raise
+
+    async def _post(self, provider, payload, priority):
+        request = await self._open(provider, payload, priority)
+        start = time.monotonic()
+        try:
+            async with request as response:
+                await self._check(provider, response)
+                result = await response.json()
+                if not result.get('choices'):
+                    raise ProviderError(provider.name, response.status, "API返回空choices")
+        except asyncio.CancelledError:
+            provider.trial_in_flight = False  # 对冲中被取消，不计入失败
+            raise
+        except RateLimited:
+            provider.trial_in_flight = False  # 限流不代表服务商故障，不触发熔断
+            raise
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - start)
+        return result
+
+    async def complete(self, payload, priority=0):
+        """非流式请求，返回 (结果json, 服务商名称)；所有服务商都限流时等待后重试"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._complete(payload, priority)
+            except RateLimited:
+                if attempt == self.max_retries:
+                    raise
+                self.logger.info(f"所有服务商均被限流，第 {attempt + 1} 次重试")
+
+    async def _complete(self, payload, priority):
+        candidates = self.ranked()
+        if not candidates:
+            # 全部熔断时仍然尝试最健康的一个，而不是直接失败
+            candidates = sorted(self.providers, key=lambda p: p.score())[:1]
+        last_error = None
+        while candidates:
+            primary = candidates.pop(0)
+            backup = candidates[0] if self.hedge and candidates else None
+            try:
+                return await self._hedged(primary, backup, payload, priority)
+            except Exception as e:
+                last_error = e
+                self.logger.warning(f"服务商 {primary.name} 请求失败，尝试下一个: {str(e)}")
+                if backup is not None and backup.state == Provider.OPEN:
+                    candidates.remove(backup)
+        raise last_error
+
+    async def _hedged(self, primary, backup, payload, priority):
+        first = asyncio.ensure_future(self._post(primary, payload, priority))
+        if backup is None:
+            return await first, primary.name
+
+        delay = max(primary.percentile(95) or 0, self.hedge_min_delay)
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result(), primary.name
+
+        self.logger.info(f"{primary.name} 超过 {delay:.2f}s 未返回，对冲请求 {backup.name}")
+        second = asyncio.ensure_future(self._post(backup, payload, priority))
+        names = {first: primary.name, second: backup.name}
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), names[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, payload, priority=0):
+        """
+        流式请求，逐行产出SSE原始数据
+        在收到第一行数据之前失败会回退到下一个服务商（全部限流时等待后重试），之后失败直接抛出；
+        还有其他服务商可选时，超过 STREAM_FIRST_BYTE_TIMEOUT 仍未收到第一行也按失败处理，
+        服务商接受连接却迟迟不返回时不必等到整个请求超时
+        """
+        payload = {**payload, "stream": True}
+        attempts = 0
+        while True:
+            candidates = self.ranked() or sorted(self.providers, key=lambda p: p.score())[:1]
+            last_error = None
+            for index, provider in enumerate(candidates):
+                started = False
+                timeout = self.first_byte_timeout if self.first_byte_timeout and index < len(candidates) - 1 else None
+                try:
+                    request = await self._open(provider, payload, priority)
+                    start = time.monotonic()
+                    try:
+                        response, first_line = await asyncio.wait_for(self._first_line(provider, request), timeout)
+                    except asyncio.TimeoutError:
+                        if timeout is None:
+                            raise
+                        raise asyncio.TimeoutError(f"{timeout}s 内未收到第一行数据")
+                    try:
+                        started = True
+                        provider.record_success(time.monotonic() - start)  # 以首字节延迟衡量健康度
+                        if first_line:
+                            yield first_line
+                            async for raw_line in response.content:
+                                yield raw_line
+                    finally:
+                        response.release()
+                    return
+                except RateLimited as e:
+                    provider.trial_in_flight = False
+                    last_error = e
+                except Exception as e:
+                    if started:
+                        raise
+                    provider.record_failure()
+                    last_error = e
+                    self.logger.warning(f"服务商 {provider.name} 流式请求失败，尝试下一个: {str(e)}")
+            if not isinstance(last_error, RateLimited) or attempts >= self.max_retries:
+                raise last_error
+            attempts += 1
+            self.logger.info(f"所有服务商均被限流，第 {attempts} 次重试")
@@ -0,0 +1,94 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+
+
+class Scheduler:
+    """
+    按截止时间排序的调度器（小顶堆）
+    任意线程都可以调用 schedule 推送/重排某个 key 的截止时间，
+    事件循环中的协程通过 wait_due 精确睡眠到下一个截止时间
+    """
+
+    def __init__(self):
+        self._heap = []  # (deadline, seq, key)，重排后旧条目惰性丢弃
+        self._deadlines = {}  # key -> 当前有效的截止时间
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+
+    def bind(self, loop):
+        """绑定到运行 wait_due 的事件循环，必须在该循环中调用"""
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, key, deadline):
+        """推送或重排 key 的截止时间（time.time() 时间戳）"""
+        with self._lock:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._counter), key))
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._compact()
+        self._notify()
+
+    def cancel(self, key):
+        with self._lock:
+            self._deadlines.pop(key, None)
+
+    def deadline(self, key):
+        with self._lock:
+            return self._deadlines.get(key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._deadlines)
+
+    def _compact(self):
+        # 丢弃已失效的堆条目，防止频繁重排导致堆无限增长
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+
+    def _notify(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wakeup.set()
+        else:
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) != deadline:
+                heapq.heappop(self._heap)  # 已被重排或取消
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append(key)
+        return due
+
+    async def wait_due(self):
+        """睡眠到下一个截止时间，返回所有已到期的 key"""
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                now = time.time()
+                due = self._pop_due(now)
+                timeout = self._heap[0][0] - now if self._heap else None
+            if due:
+                return due
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
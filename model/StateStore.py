@@ -0,0 +1,125 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class StateStore:
+    """
+    用户运行状态快照（对话上下文、待处理消息、主动消息计时）
+    状态变化只标记为脏，由后台线程定期批量写入 SQLite（WAL 模式即追加日志 + 检查点），
+    用户对象首次创建时再按需读取，启动时不做全量加载
+    """
+
+    def __init__(self, logger, config, db_path):
+        self.logger = logger
+        self.interval = config["STATE_CHECKPOINT_INTERVAL"]
+        self.db_path = db_path
+        self._dirty = {}  # name -> User
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"checkpoints": 0, "users_saved": 0, "last_checkpoint_ms": 0.0,
+                      "restores": 0, "last_restore_ms": 0.0}
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                "name TEXT PRIMARY KEY, prompt_name TEXT, has_pending INTEGER, state TEXT, updated REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="state-checkpoint", daemon=True)
+            self._thread.start()
+
+    def mark_dirty(self, user):
+        with self._lock:
+            self._dirty[user.name] = user
+
+    def load(self, name):
+        """读取单个用户的快照，没有时返回 None"""
+        start = time.perf_counter()
+        with self._db_lock:
+            row = self._connect().execute("SELECT state FROM user_state WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        self.stats["restores"] += 1
+        self.stats["last_restore_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return state
+
+    def restore(self, user):
+        """把快照恢复到新创建的 User 上，返回是否有快照"""
+        state = self.load(user.name)
+        if state is None or state.get("prompt_name") != user.prompt_name:
+            return False  # 更换了 prompt 的聊天不恢复旧上下文
+        user.restore_state(state)
+        self.logger.info(f"已恢复 {user.name} 的运行状态 ({self.stats['last_restore_ms']}ms)")
+        return True
+
+    def pending_names(self):
+        """有未处理消息的用户，启动时需要立即恢复以便继续回复"""
+        with self._db_lock:
+            return [row[0] for row in self._connect().execute("SELECT name FROM user_state WHERE has_pending = 1")]
+
+    def proactive_states(self):
+        """所有快照的 (聊天, prompt, 下一次主动消息时间, 已发送主动消息数)，启动时直接排期，不创建 User"""
+        with self._db_lock:
+            return self._connect().execute(
+                "SELECT name, prompt_name, "
+                "json_extract(state, '$.user_timers') + json_extract(state, '$.user_wait_time'), "
+                "COALESCE(json_extract(state, '$.proactive_sent'), 0) FROM user_state"
+            ).fetchall()
+
+    def checkpoint(self):
+        """把所有脏用户的快照写入磁盘"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        start = time.perf_counter()
+        rows = []
+        for user in dirty.values():
+            state = user.snapshot()
+            rows.append((user.name, user.prompt_name, 1 if state["queue"] else 0,
+                         json.dumps(state, ensure_ascii=False), time.time()))
+        with self._db_lock:
+            db = self._connect()
+            db.executemany("INSERT OR REPLACE INTO user_state (name, prompt_name, has_pending, state, updated) "
+                           "VALUES (?, ?, ?, ?, ?)", rows)
+            db.commit()
+        self.stats["checkpoints"] += 1
+        self.stats["users_saved"] += len(rows)
+        self.stats["last_checkpoint_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        self.logger.debug(f"状态检查点: {len(rows)} 个用户, {self.stats['last_checkpoint_ms']}ms")
+        return len(rows)
+
+    def close(self):
+        """退出前写入最后一次检查点"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.checkpoint()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                self.logger.error(f"保存用户状态失败: {str(e)}")
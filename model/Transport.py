@@ -0,0 +1,135 @@
+import time
+from abc import ABC, abstractmethod
+
+
+class TransportError(Exception):
+    """聊天通道本身故障（客户端断开、窗口丢失等），与单条消息的处理错误区分"""
+
+
+class Transport(ABC):
+    """
+    聊天通道接口：连接、添加监听、拉取新消息、发送、截图
+    都由 UI 调度线程调用，实现不需要考虑并发
+    拉取到的消息需要有 type / content / sender 属性（与 wxauto 的消息对象一致）
+    """
+
+    connected = False
+
+    @abstractmethod
+    def connect(self):
+        ...
+
+    def disconnect(self):
+        self.connected = False
+
+    def alive(self):
+        """客户端是否仍然可用，不可用时需要重新连接"""
+        return self.connected
+
+    @abstractmethod
+    def listening(self):
+        """仍在监听的聊天，用于只重新订阅丢失的监听"""
+
+    @abstractmethod
+    def add_listen_chat(self, chat):
+        ...
+
+    @abstractmethod
+    def get_listen_messages(self):
+        """返回 {聊天名: [消息, ...]}"""
+
+    @abstractmethod
+    def send(self, text, chat):
+        ...
+
+    @abstractmethod
+    def screenshot(self, chat, path):
+        """截取聊天窗口保存到 path，成功返回 path，失败返回 None"""
+
+
+class WxTransport(Transport):
+    """基于 wxauto 的微信客户端（仅 Windows），wxauto / pyautogui 在连接时才导入"""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.wx = None
+
+    def connect(self):
+        from wxauto import WeChat
+        self.wx = WeChat()
+        self.connected = True
+
+    def disconnect(self):
+        self.wx = None
+        self.connected = False
+
+    def alive(self):
+        if self.wx is None:
+            return False
+        try:
+            return bool(self.wx.UiaAPI.Exists(0))
+        except Exception:
+            return False
+
+    def listening(self):
+        """监听窗口已关闭的聊天从 wx.listen 中移除，AddListenChat 才会重新添加"""
+        if self.wx is None:
+            return set()
+        alive = set()
+        for who, chat in list(self.wx.listen.items()):
+            try:
+                exists = chat.UiaAPI.Exists(0)
+            except Exception:
+                exists = False
+            if exists:
+                alive.add(who)
+            else:
+                del self.wx.listen[who]
+        return alive
+
+    def add_listen_chat(self, chat):
+        self.wx.AddListenChat(who=chat, savepic=True)
+
+    def get_listen_messages(self):
+        try:
+            msgs = self.wx.GetListenMessage()
+        except Exception as e:
+            raise TransportError(f"拉取消息失败: {str(e)}") from e
+        return {chat.who: msgs.get(chat) for chat in msgs}
+
+    def send(self, text, chat):
+        self.wx.SendMsg(text, chat)
+
+    def screenshot(self, chat, path):
+        import pyautogui
+        try:
+            # 激活并定位微信聊天窗口
+            self.wx.ChatWith(chat)
+            chat_window = pyautogui.getWindowsWithTitle(chat)[0]
+
+            # 确保窗口被前置和激活（不再最大化，截图只需要聊天窗口本身，裁剪在上传前进行）
+            if not chat_window.isActive:
+                chat_window.activate()
+
+            # 获取窗口的坐标和大小
+            x, y, width, height = chat_window.left, chat_window.top, chat_window.width, chat_window.height
+
+            time.sleep(1)
+
+            # 截取指定窗口区域的屏幕
+            screenshot = pyautogui.screenshot(region=(x, y, width, height))
+            screenshot.save(path)
+            self.logger.info(f'已保存截图: {path}')
+            return path
+        except Exception as e:
+            if not self.alive():
+                raise TransportError(f"截图失败，微信连接已断开: {str(e)}") from e
+            self.logger.error(f'保存截图失败: {str(e)}')
+
+
+def create_transport(logger, config):
+    """按 TRANSPORT 配置创建聊天通道：wx 为真实微信，fake 为离线回放/压测"""
+    if config["TRANSPORT"] == "fake":
+        from model.FakeTransport import FakeTransport
+        return FakeTransport(logger=logger, config=config)
+    return WxTransport(logger=logger)
@@ -1,31 +1,52 @@
 import os
 import random
-import shutil
 import threading
 import time
 from datetime import datetime
-import pyautogui
-from wxauto import WeChat
+
+from model.ChatContext import ChatContext
+from model.InboundBuffer import InboundBuffer
 
 
 class User:
-    def __init__(self, name, prompt_name, logger, config):
+    # 监听的聊天可能有数千个，大多数长期空闲，用 __slots__ 省去每个实例的 __dict__
+    __slots__ = ("config", "log_writer", "name", "prompt_name", "inbox", "user_timers", "user_wait_time", "logger",
+                 "prompt", "context", "is_sending_message", "can_send_messages", "pending_media", "emoji_hold",
+                 "proactive_sent", "queue_lock")
+
+    _prompt_cache = {}  # prompt_name -> prompt 文本，使用相同 prompt 的聊天共享同一份
+    _prompt_lock = threading.Lock()
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+
+    def __init__(self, name, prompt_name, logger, config, log_writer=None):
         self.config = config
+        self.log_writer = log_writer  # 共享的后台日志写入线程
         self.name = name
         self.prompt_name = prompt_name
-        self.user_queues = {}
+        self.inbox = InboundBuffer(config["INBOUND_CAPACITY"], config["INBOUND_MAX_BYTES"])  # 待回复的消息
         self.user_timers = 0
         self.user_wait_time = 0
         self.make_user_auto_time()
         self.logger = logger
-        self.root_dir = os.path.dirname(os.path.abspath(__file__))
         self.prompt = self.get_user_prompt()
-        self.chat_contexts = []  # 存储用户的对话上下文
+        self.context = ChatContext(config)  # 存储用户的对话上下文，按token预算裁剪
         self.is_sending_message = False  # 正在发送消息不向DeepSeek发送
         self.can_send_messages = True  # 是否可以发送消息（处理图片数据时等待）
+        self.pending_media = 0  # 正在识别中的图片/表情包数量
+        self.emoji_hold = False  # 表情包等待合并期间不回复，由 hold/release 事件设置
+        self.proactive_sent = 0  # 用户上次发言后已发送的主动消息数
         self.queue_lock = threading.Lock()  # 用户级别的队列锁
 
     def get_user_prompt(self):
+        prompt = User._prompt_cache.get(self.prompt_name)
+        if prompt is not None:
+            return prompt
+        with User._prompt_lock:
+            if self.prompt_name not in User._prompt_cache:
+                User._prompt_cache[self.prompt_name] = self.read_user_prompt()
+            return User._prompt_cache[self.prompt_name]
+
+    def read_user_prompt(self):
         root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         prompt_path = os.path.join(root_dir, 'prompts', f'{self.prompt_name}.md')
 
@@ -40,27 +61,41 @@ class User:
         self.user_timers = time.time()
         self.user_wait_time = random.uniform(self.config["MIN_WAIT_TIME"], self.config["MAX_WAIT_TIME"]) * 3600
 
-    def make_log_user(self, content):
-        log_file = os.path.join(self.root_dir, self.config["MEMORY_TEMP_DIR"], f'{self.name}_{self.prompt_name}_User_log.txt')
-        log_entry = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | [User] {content}\n"
+    def snapshot(self):
+        """运行状态快照，用于重启后恢复；识别中的图片不保存"""
+        with self.queue_lock:
+            queue = []
+            for item in self.inbox.items():
+                text = item if isinstance(item, str) else item.render() if item.done else ""
+                if text:
+                    queue.append(text)
+            last_message_time = self.inbox.last_time
+        return {
+            "prompt_name": self.prompt_name,
+            "context": self.context.to_dict(),
+            "queue": queue,
+            "last_message_time": last_message_time,
+            "user_timers": self.user_timers,
+            "user_wait_time": self.user_wait_time,
+            "proactive_sent": self.proactive_sent,
+        }
 
-        if os.path.exists(log_file) and os.path.getsize(log_file) > 1 * 1024 * 1024:
-            archive_file = os.path.join(self.root_dir, self.config["MEMORY_TEMP_DIR"],
-                                        f'{self.name}_log_archive_{int(time.time())}.txt')
-            shutil.move(log_file, archive_file)
+    def restore_state(self, state):
+        self.context.load(state["context"])
+        self.user_timers = state["user_timers"]
+        self.user_wait_time = state["user_wait_time"]
+        self.proactive_sent = state.get("proactive_sent", 0)
+        if state["queue"]:
+            with self.queue_lock:
+                self.inbox.restore(state["queue"], state["last_message_time"])
 
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
+    def log_path(self, kind):
+        return os.path.join(self.root_dir, self.config["MEMORY_TEMP_DIR"], f'{self.name}_{self.prompt_name}_{kind}_log.txt')
 
-    def make_log_reply(self, content):
+    def make_log_user(self, content):
+        log_entry = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | [User] {content}\n"
+        self.log_writer.write(self.log_path("User"), log_entry)
 
-        log_file = os.path.join(self.root_dir, self.config['MEMORY_TEMP_DIR'], f'{self.name}_{self.prompt_name}_AI_log.txt')
+    def make_log_reply(self, content):
         log_entry = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | [AI] {content}\n"
-
-        if os.path.exists(log_file) and os.path.getsize(log_file) > 1 * 1024 * 1024:  # 1MB
-            archive_file = os.path.join(self.root_dir, self.config['MEMORY_TEMP_DIR'],
-                                        f'{self.name}_log_archive_{int(time.time())}.txt')
-            shutil.move(log_file, archive_file)
-
-        with open(log_file, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
+        self.log_writer.write(self.log_path("AI"), log_entry)
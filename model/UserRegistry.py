@@ -0,0 +1,83 @@
+import os
+import threading
+
+from model.User import User
+
+
+class UserRegistry:
+    """
+    聊天名 -> User 的注册表
+    LISTEN_LIST 中的每个 (聊天, prompt) 都会被监听，User 对象在首次收到消息时才创建
+    """
+
+    def __init__(self, listen_list, logger, config, log_writer=None, state_store=None):
+        self.logger = logger
+        self.config = config
+        self.log_writer = log_writer
+        self.state_store = state_store  # 可选，创建 User 时恢复上次的运行状态
+        self.prompt_names = self.parse_listen_list(listen_list)  # 聊天名 -> prompt_name
+        self._users = {}
+        self._lock = threading.Lock()
+        self.check_prompts()
+
+    @staticmethod
+    def parse_listen_list(listen_list):
+        """
+        支持三种写法：
+          旧格式 [聊天, prompt]
+          [[聊天, prompt], ...]
+          [{chat: 聊天, prompt: prompt}, ...]
+        """
+        if len(listen_list) == 2 and all(isinstance(item, str) for item in listen_list):
+            return {listen_list[0]: listen_list[1]}
+
+        prompt_names = {}
+        for item in listen_list:
+            if isinstance(item, dict):
+                chat, prompt_name = item["chat"], item["prompt"]
+            else:
+                chat, prompt_name = item
+            prompt_names[str(chat)] = str(prompt_name)
+        return prompt_names
+
+    def check_prompts(self):
+        """启动时只检查 prompt 文件是否存在，内容在创建 User 时读取"""
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for prompt_name in set(self.prompt_names.values()):
+            prompt_path = os.path.join(root_dir, 'prompts', f'{prompt_name}.md')
+            if not os.path.exists(prompt_path):
+                self.logger.error(f"Prompt文件不存在: {prompt_path}")
+                raise FileNotFoundError(f"Prompt文件 {prompt_name}.md 未找到于 prompts 目录")
+
+    def get(self, name):
+        """O(1) 查找用户，不在监听列表中返回 None"""
+        user = self._users.get(name)
+        if user is not None:
+            return user
+        prompt_name = self.prompt_names.get(name)
+        if prompt_name is None:
+            return None
+        with self._lock:
+            user = self._users.get(name)
+            if user is None:
+                user = User(name=name, prompt_name=prompt_name, logger=self.logger, config=self.config,
+                            log_writer=self.log_writer)
+                if self.state_store is not None:
+                    self.state_store.restore(user)
+                self._users[name] = user
+                self.logger.info(f"已创建用户: {name} ({prompt_name})")
+            return user
+
+    def names(self):
+        """所有需要监听的聊天名"""
+        return list(self.prompt_names)
+
+    def users(self):
+        """已创建的用户"""
+        return list(self._users.values())
+
+    def __contains__(self, name):
+        return name in self.prompt_names
+
+    def __len__(self):
+        return len(self.prompt_names)
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+
+class VisionJob:
+    """一条待识别的图片/表情包消息，在用户队列中占据其到达时的位置"""
+
+    def __init__(self, user, img_path, is_emoji=False):
+        self.user = user
+        self.img_path = img_path
+        self.is_emoji = is_emoji
+        self.time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.text = None
+        self.done = False
+        self.queued = time.monotonic()  # 以下三个时间点用于统计排队和识别耗时
+        self.started = None
+        self.finished = None
+
+    def render(self):
+        """识别完成后拼回队列时的文本，识别失败返回空字符串"""
+        if not self.text:
+            return ""
+        return f"[{self.time}] {self.text}"
+
+
+class VisionPipeline:
+    """
+    异步图片识别流水线：监听线程只负责投递任务，
+    由发送线程事件循环中的固定数量 worker 并发调用视觉接口
+    """
+
+    def __init__(self, ai, logger, config, on_done, cache=None):
+        self.ai = ai
+        self.cache = cache  # 可选的 MediaCache，命中时不再调用视觉接口
+        self.logger = logger
+        self.workers = config["MAX_CONCURRENT_VISION_CALLS"]
+        self.queue_size = config["VISION_QUEUE_SIZE"]
+        self.on_done = on_done  # 在事件循环线程中回调 on_done(job)
+        self._loop = None
+        self._queue = None
+        self._backlog = []  # 事件循环启动前收到的任务
+        self._lock = threading.Lock()
+
+    def start(self, loop):
+        """在发送线程的事件循环中启动 worker"""
+        with self._lock:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            backlog, self._backlog = self._backlog, []
+        for _ in range(self.workers):
+            loop.create_task(self._worker())
+        for job in backlog:
+            self._enqueue(job)
+        self.logger.info(f"图片识别流水线已启动: workers={self.workers}")
+
+    def submit(self, job):
+        """线程安全地投递任务，不会阻塞调用方"""
+        with self._lock:
+            if self._loop is None:
+                self._backlog.append(job)
+                return
+        self._loop.call_soon_threadsafe(self._enqueue, job)
+
+    def _enqueue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.logger.warning(f"图片识别队列已满，跳过识别: {job.img_path}")
+            self._finish(job, "")
+
+    def queue_depth(self):
+        if self._queue is None:
+            return len(self._backlog)
+        return self._queue.qsize()
+
+    def _finish(self, job, text):
+        job.text = text
+        job.finished = time.monotonic()
+        job.done = True
+        try:
+            self.on_done(job)
+        except Exception as e:
+            self.logger.error(f"图片识别回调失败: {str(e)}")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.started = time.monotonic()
+            text = ""
+            try:
+                text = await self._recognize(job)
+            except Exception as e:
+                self.logger.error(f"图片识别任务失败: {str(e)}")
+            finally:
+                self._finish(job, text)
+                self._queue.task_done()
+
+    async def _recognize(self, job):
+        # 表情包是聊天窗口截图，每次都不同，不查缓存
+        if self.cache is None or job.is_emoji:
+            return await self.ai.moonshot_image(job.img_path, is_emoji=job.is_emoji)
+
+        fp = await asyncio.to_thread(self.cache.fingerprint, job.img_path)
+        text = await asyncio.to_thread(self.cache.get, fp)
+        if text is not None:
+            self.logger.info(f"图片识别缓存命中: {job.img_path}, {self.cache.get_stats()}")
+            return text
+        text = await self.ai.moonshot_image(job.img_path, is_emoji=job.is_emoji)
+        if text:
+            await asyncio.to_thread(self.cache.put, fp, text)
+        return text
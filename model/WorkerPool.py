@@ -0,0 +1,129 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+
+def shard_of(chat, workers):
+    """聊天固定分配到一个工作进程（crc32 在不同进程间稳定，hash() 不是）"""
+    return zlib.crc32(chat.encode("utf-8")) % workers
+
+
+class WorkerPool:
+    """
+    拆分模式的前端：微信只在前端进程中操作，整理好的入站事件按聊天分片发给工作进程，
+    工作进程的出站消息回到前端，由前端唯一的 Dispatcher 发送并回传结果；
+    工作进程崩溃后自动重启，仍在队列中的事件由新进程继续处理；
+    已被旧进程取出、还在其用户队列中等待回复的消息不会重发：开启 STATE_SWITCH 时
+    新进程从最近一次状态检查点恢复，检查点之后收到的消息丢失；未开启时全部丢失
+    """
+
+    def __init__(self, logger, config, dispatcher):
+        self.logger = logger
+        self.workers = config["WORKER_PROCESSES"]
+        self.dispatcher = dispatcher
+        self._ctx = multiprocessing.get_context("spawn")  # Windows 只支持 spawn，各平台保持一致
+        self.inbound = [self._ctx.Queue() for _ in range(self.workers)]
+        self.acks = [self._ctx.Queue() for _ in range(self.workers)]
+        self.outbound = self._ctx.Queue()
+        self._processes = [None] * self.workers
+        self._target = None
+        self._closing = False
+        self.stats = {"routed": 0, "sent": 0, "restarts": 0}
+
+    def start(self, target):
+        """target(index, inbound, outbound, acks) 在工作进程中运行"""
+        self._target = target
+        for index in range(self.workers):
+            self._spawn(index)
+        threading.Thread(target=self._pump, name="worker-outbound", daemon=True).start()
+        threading.Thread(target=self._supervise, name="worker-supervisor", daemon=True).start()
+        self.logger.info(f"已启动 {self.workers} 个工作进程")
+
+    def _spawn(self, index):
+        # 工作进程重新导入主模块时不会初始化任何组件，由 target 按工作进程的角色初始化
+        process = self._ctx.Process(target=self._target, name=f"wxbot-worker-{index}", daemon=True,
+                                    args=(index, self.inbound[index], self.outbound, self.acks[index]))
+        process.start()
+        self._processes[index] = process
+
+    def route(self, event):
+        self.inbound[shard_of(event["chat"], self.workers)].put(event)
+        self.stats["routed"] += 1
+
+    def _pump(self):
+        while True:
+            index, key, chat, text, priority = self.outbound.get()
+            future = self.dispatcher.send(chat, text, priority)
+            future.add_done_callback(lambda f, i=index, k=key: self._ack(i, k, f))
+
+    def _ack(self, index, key, future):
+        error = future.exception()
+        if error is None:
+            self.stats["sent"] += 1
+        self.acks[index].put((key, None if error is None else str(error)))
+
+    def _supervise(self):
+        while not self._closing:
+            time.sleep(1)
+            for index, process in enumerate(self._processes):
+                if not self._closing and not process.is_alive():
+                    self.logger.error(f"工作进程 {index} 已退出 (exitcode={process.exitcode})，正在重启；"
+                                      f"它已取出但未回复的消息只能从状态检查点恢复")
+                    self.stats["restarts"] += 1
+                    self._spawn(index)
+
+    def close(self, timeout=5):
+        self._closing = True
+        for queue in self.inbound:
+            queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+
+
+class RemoteDispatcher:
+    """工作进程中代替 Dispatcher：send 转发给前端进程，前端实际发送完成后 Future 才完成"""
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.index = None
+        self._outbound = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.stats = {"sent": 0, "failed": 0}
+
+    def attach(self, index, outbound, acks):
+        self.index = index
+        self._outbound = outbound
+        threading.Thread(target=self._receive_acks, args=(acks,), name="worker-acks", daemon=True).start()
+
+    def send(self, chat, text, priority=0):
+        future = Future()
+        key = (os.getpid(), next(self._counter))  # 带上进程号，重启后不会认领旧进程的回执
+        with self._lock:
+            self._futures[key] = future
+        self._outbound.put((self.index, key, chat, text, priority))
+        return future
+
+    def pending(self):
+        with self._lock:
+            return len(self._futures)
+
+    def _receive_acks(self, acks):
+        while True:
+            key, error = acks.get()
+            with self._lock:
+                future = self._futures.pop(key, None)
+            if future is None:
+                continue
+            if error is None:
+                self.stats["sent"] += 1
+                future.set_result(None)
+            else:
+                self.stats["failed"] += 1
+                future.set_exception(RuntimeError(error))
@@ -0,0 +1,77 @@
+import unittest
+
+from model.ChatContext import ChatContext, estimate_tokens
+
+CONFIG = {"CONTEXT_TOKEN_BUDGET": 100, "CONTEXT_LOW_WATER": 0.7, "SUMMARY_TOKEN_BUDGET": 20}
+TEXT = "x" * 40  # 10 个token，加上开销每条 14 个
+
+
+def filled(count):
+    context = ChatContext(CONFIG)
+    for index in range(count):
+        context.append("user" if index % 2 == 0 else "assistant", TEXT)
+    return context
+
+
+class ChatContextTest(unittest.TestCase):
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("x" * 8), 2)
+        self.assertEqual(estimate_tokens("你好"), 2)
+
+    def test_within_budget_keeps_everything(self):
+        context = filled(7)
+        self.assertEqual(len(context), 7)
+        self.assertEqual(context.tokens, 98)
+        self.assertFalse(context.needs_compaction())
+
+    def test_trim_to_low_water(self):
+        context = filled(8)
+        self.assertEqual(len(context), 5)
+        self.assertEqual(context.tokens, 70)
+        self.assertEqual(len(context.evicted), 3)
+        # 裁剪后留出余量，再追加一条不会再次裁剪
+        context.append("user", TEXT)
+        self.assertEqual(len(context), 6)
+        self.assertEqual(len(context.evicted), 3)
+
+    def test_keeps_latest_message(self):
+        context = ChatContext(CONFIG)
+        context.append("user", "x" * 1000)
+        self.assertEqual(len(context), 1)
+
+    def test_summary_compaction(self):
+        context = filled(8)
+        evicted = context.take_evicted()
+        self.assertFalse(context.needs_compaction())
+        context.compact_locally(evicted)
+        # 超出摘要预算时丢弃摘要最早的部分，只剩最后移出的一条
+        self.assertEqual(context.summary, f"用户: {TEXT}")
+        self.assertLessEqual(estimate_tokens(context.summary), CONFIG["SUMMARY_TOKEN_BUDGET"])
+        # 摘要占用预算后，最近对话按剩余预算重新裁剪
+        self.assertLessEqual(context.tokens, CONFIG["CONTEXT_TOKEN_BUDGET"] - estimate_tokens(context.summary))
+        messages = context.messages("系统")
+        self.assertEqual(messages[0], {"role": "system", "content": "系统"})
+        self.assertIn(context.summary, messages[1]["content"])
+        self.assertEqual(len(messages), len(context) + 2)
+
+    def test_summary_shrinks_budget(self):
+        context = filled(7)
+        context.set_summary("y" * 200)  # 截断到 80 个字符加省略号，共 21 个token
+        self.assertEqual(context.summary, "y" * 80 + "…")
+        # 剩余预算 79，裁剪到 79 * 0.7 以下
+        self.assertEqual(len(context), 3)
+        self.assertEqual(context.tokens, 42)
+        self.assertEqual(len(context.evicted), 4)
+
+    def test_snapshot_round_trip(self):
+        context = filled(8)
+        context.set_summary("早先聊过天气")
+        restored = ChatContext(CONFIG)
+        restored.load(context.to_dict())
+        self.assertEqual(restored.messages("系统"), context.messages("系统"))
+        self.assertEqual(restored.tokens, context.tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
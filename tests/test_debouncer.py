@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+import unittest
+
+from model.Debouncer import Debouncer
+
+
+class DebouncerTest(unittest.TestCase):
+    def setUp(self):
+        self.debouncer = Debouncer(logging.getLogger("test"))
+        self.calls = []
+        self.done = threading.Event()
+
+    def record(self, value):
+        def callback():
+            self.calls.append(value)
+            self.done.set()
+        return callback
+
+    def test_coalesce_same_key(self):
+        for value in range(5):
+            self.debouncer.call_later("a", 0.1, self.record(value))
+        self.assertTrue(self.done.wait(2))
+        time.sleep(0.2)
+        self.assertEqual(self.calls, [4])
+        self.assertFalse(self.debouncer.pending("a"))
+
+    def test_keys_independent(self):
+        self.debouncer.call_later("a", 0.05, self.record("a"))
+        self.debouncer.call_later("b", 0.1, self.record("b"))
+        self.debouncer.call_later("a", 0.15, self.record("a2"))
+        time.sleep(0.4)
+        self.assertEqual(self.calls, ["b", "a2"])
+
+    def test_cancel(self):
+        self.debouncer.call_later("a", 0.05, self.record("a"))
+        self.debouncer.cancel("a")
+        time.sleep(0.2)
+        self.assertEqual(self.calls, [])
+
+    def test_failed_callback_does_not_stop_timer(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertLogs("test", level="ERROR"):
+            self.debouncer.call_later("a", 0.01, fail)
+            self.debouncer.call_later("b", 0.05, self.record("b"))
+            self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.calls, ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
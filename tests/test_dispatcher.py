@@ -0,0 +1,84 @@
+import logging
+import threading
+import unittest
+from concurrent.futures import TimeoutError, wait
+
+from model.Dispatcher import Dispatcher
+
+
+class DispatcherTest(unittest.TestCase):
+    def make(self, rate=0):
+        self.log = []
+        return Dispatcher(logging.getLogger("test"), {"SEND_RATE_PER_MINUTE": rate},
+                          lambda text, chat: self.log.append((chat, text)))
+
+    def block(self, dispatcher):
+        """占住调度线程，让后续任务先排队"""
+        gate, entered = threading.Event(), threading.Event()
+
+        def hold():
+            entered.set()
+            gate.wait(5)
+
+        dispatcher.call(hold, chat="gate")
+        self.assertTrue(entered.wait(5))
+        return gate
+
+    def test_priority_between_chats(self):
+        dispatcher = self.make()
+        gate = self.block(dispatcher)
+        futures = [
+            dispatcher.send("a", "主动", Dispatcher.PRIORITY_PROACTIVE),
+            dispatcher.call(lambda: self.log.append((None, "拉取"))),
+            dispatcher.send("b", "回复", Dispatcher.PRIORITY_INTERACTIVE),
+        ]
+        gate.set()
+        wait(futures, 5)
+        self.assertEqual(self.log, [("b", "回复"), (None, "拉取"), ("a", "主动")])
+
+    def test_fifo_within_chat(self):
+        dispatcher = self.make()
+        gate = self.block(dispatcher)
+        futures = [
+            dispatcher.send("a", "1", Dispatcher.PRIORITY_PROACTIVE),
+            dispatcher.send("a", "2", Dispatcher.PRIORITY_INTERACTIVE),
+            dispatcher.call(lambda: self.log.append(("a", "3")), chat="a", priority=Dispatcher.PRIORITY_INTERACTIVE),
+        ]
+        gate.set()
+        wait(futures, 5)
+        self.assertEqual(self.log, [("a", "1"), ("a", "2"), ("a", "3")])
+        self.assertEqual(dispatcher.stats["sent"], 2)
+
+    def test_quota_only_pauses_sends(self):
+        dispatcher = self.make(rate=2)
+        sends = [dispatcher.send("a", str(index)) for index in range(3)]
+        wait(sends[:2], 5)
+        self.assertEqual(dispatcher.run(lambda: "ok"), "ok")  # 额度用完时其他 UI 操作照常执行
+        with self.assertRaises(TimeoutError):
+            sends[2].result(0.3)
+        self.assertEqual(self.log, [("a", "0"), ("a", "1")])
+        self.assertGreaterEqual(dispatcher.stats["throttled"], 1)
+        self.assertEqual(dispatcher.pending(), 1)
+
+    def test_non_positive_rate_is_unlimited(self):
+        for rate in (0, -1):
+            dispatcher = self.make(rate)
+            sends = [dispatcher.send("a", str(index)) for index in range(20)]
+            done, _ = wait(sends, 5)
+            self.assertEqual(len(done), 20)
+            self.assertEqual(dispatcher.stats["throttled"], 0)
+
+    def test_error_goes_to_future(self):
+        dispatcher = self.make()
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertLogs("test", level="ERROR"):
+            with self.assertRaises(ValueError):
+                dispatcher.run(fail)
+        self.assertEqual(dispatcher.run(lambda: 1), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
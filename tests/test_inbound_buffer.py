@@ -0,0 +1,89 @@
+import unittest
+
+from model.InboundBuffer import InboundBuffer
+
+
+class FakeJob:
+    """代替图片识别任务，缓冲区只按位置保存，不计字节"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class InboundBufferTest(unittest.TestCase):
+    def test_keeps_order_until_full(self):
+        buffer = InboundBuffer(3, 1024)
+        for index, text in enumerate(["a", "b", "c"]):
+            self.assertFalse(buffer.push(text, now=100 + index))
+        self.assertEqual(buffer.items(), ["a", "b", "c"])
+        self.assertEqual((buffer.first_time, buffer.last_time), (100, 102))
+        self.assertEqual(buffer.bytes, 3)
+
+    def test_coalesce_adjacent_text(self):
+        buffer = InboundBuffer(3, 1024)
+        for text in ["a", "b", "c"]:
+            buffer.push(text)
+        self.assertTrue(buffer.push("d"))
+        self.assertEqual(buffer.items(), ["a b", "c", "d"])
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.bytes, 5)  # 合并时补一个空格
+        self.assertEqual(buffer.merged, 1)
+
+    def test_coalesce_skips_media(self):
+        buffer = InboundBuffer(3, 1024)
+        image = FakeJob("图片")
+        for item in [image, "a", "b"]:
+            buffer.push(item)
+        buffer.push("c")
+        self.assertEqual(buffer.items(), [image, "a b", "c"])
+        # 没有相邻文本时把最早的两个槽位合并为列表，展开后顺序不变
+        other = FakeJob("表情")
+        buffer = InboundBuffer(2, 1024)
+        for item in [image, "a", other]:
+            buffer.push(item)
+        self.assertEqual(buffer.items(), [image, "a", other])
+        self.assertEqual(len(buffer), 2)
+
+    def test_capacity_at_least_two(self):
+        buffer = InboundBuffer(1, 1024)
+        self.assertEqual(buffer.capacity, 2)
+        for text in ["a", "b", "c"]:
+            buffer.push(text)
+        self.assertEqual(buffer.items(), ["a b", "c"])
+
+    def test_summarize_longest(self):
+        buffer = InboundBuffer(5, 200)
+        buffer.push("短消息")
+        buffer.push("x" * 300)
+        items = buffer.items()
+        self.assertEqual(items[0], "短消息")
+        self.assertIn("…(省略", items[1])
+        self.assertTrue(items[1].startswith("x") and items[1].endswith("x"))
+        self.assertLessEqual(buffer.bytes, 200)
+        self.assertEqual(buffer.bytes, sum(InboundBuffer.size_of(item) for item in items))
+        self.assertGreaterEqual(buffer.summarized, 1)
+        self.assertEqual(buffer.total_bytes, 309)
+
+    def test_drain_reuses_slots(self):
+        buffer = InboundBuffer(3, 1024)
+        for text in ["a", "b", "c", "d"]:
+            buffer.push(text)
+        self.assertEqual(buffer.drain(), ["a b", "c", "d"])
+        self.assertEqual((len(buffer), buffer.bytes), (0, 0))
+        buffer.push("e", now=200)
+        self.assertEqual(buffer.items(), ["e"])
+        self.assertEqual(buffer.first_time, 200)
+        self.assertEqual(buffer.get_stats()["messages"], 5)
+
+    def test_restore(self):
+        buffer = InboundBuffer(3, 1024)
+        buffer.restore(["a", "b"], 123)
+        self.assertEqual(buffer.items(), ["a", "b"])
+        self.assertEqual(buffer.last_time, 123)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import logging
+import os
+import re
+import tempfile
+import time
+import unittest
+
+from model.LogWriter import LogWriter
+
+
+def make_writer(**overrides):
+    config = {"LOG_MAX_BYTES": 1 << 20, "LOG_BATCH_SIZE": 4, "LOG_FLUSH_INTERVAL": 60}
+    config.update(overrides)
+    return LogWriter(logging.getLogger("test"), config)
+
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "user_log.txt")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+    def test_commit_by_batch_size(self):
+        writer = make_writer()
+        for index in range(4):
+            writer.write(self.path, f"{index}\n")
+        for _ in range(100):
+            if writer.stats["batches"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(writer.stats, {"lines": 4, "batches": 1, "rotations": 0})
+        self.assertEqual(self.read(), "0\n1\n2\n3\n")
+        writer.close()
+
+    def test_commit_by_interval(self):
+        writer = make_writer(LOG_FLUSH_INTERVAL=0.05)
+        writer.write(self.path, "a\n")
+        time.sleep(0.3)
+        self.assertEqual(self.read(), "a\n")
+        self.assertEqual(writer.stats["batches"], 1)
+        writer.close()
+
+    def test_close_flushes_pending(self):
+        writer = make_writer()
+        writer.write(self.path, "a\n")
+        writer.write(self.path, "b\n")
+        writer.close()
+        self.assertEqual(self.read(), "a\nb\n")
+        self.assertEqual(writer.stats["lines"], 2)
+        self.assertEqual(writer.pending(), 0)
+
+    def test_flush_groups_by_file(self):
+        other = os.path.join(self.dir.name, "other_log.txt")
+        writer = make_writer()
+        writer.write(self.path, "a\n")
+        writer.write(other, "b\n")
+        writer.flush(5)
+        self.assertEqual(self.read(), "a\n")
+        with open(other, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "b\n")
+        self.assertEqual(writer.stats["batches"], 1)
+        writer.close()
+
+    def test_rotation_naming(self):
+        writer = make_writer(LOG_MAX_BYTES=4)
+        for line in ["first\n", "second\n", "third\n"]:
+            writer.write(self.path, line)
+            writer.flush(5)
+        writer.close()
+        self.assertEqual(self.read(), "third\n")
+        archives = sorted(name for name in os.listdir(self.dir.name) if name != "user_log.txt")
+        self.assertEqual(len(archives), 2)
+        self.assertEqual(writer.stats["rotations"], 2)
+        for name in archives:
+            self.assertRegex(name, r"^user_log_archive_\d{14}_\d+\.txt$")
+        # 同一秒内轮转时序号递增，不会覆盖之前的归档
+        stamps = [re.match(r"user_log_archive_(\d{14})_(\d+)", name).groups() for name in archives]
+        if stamps[0][0] == stamps[1][0]:
+            self.assertEqual([seq for _, seq in stamps], ["0", "1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
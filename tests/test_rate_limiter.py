@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+import unittest
+
+from model.RateLimiter import RateLimiter, TokenBucket
+
+CONFIG = {
+    "RATE_LIMITS": {"default": {"rpm": 600, "tpm": 100000}, "slow": {"rpm": 60, "tpm": 120}},
+    "RATE_LIMIT_BACKOFF_BASE": 1.0,
+    "RATE_LIMIT_BACKOFF_MAX": 3.0,
+}
+
+
+def make_limiter():
+    return RateLimiter(logging.getLogger("test"), CONFIG)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_delay_and_refill(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated
+        self.assertEqual(bucket.delay(60, now), 0)
+        bucket.take(60)
+        self.assertAlmostEqual(bucket.delay(1, now), 1.0)
+        self.assertAlmostEqual(bucket.delay(1, now + 0.5), 0.5)
+        # 超过桶容量的请求等到桶满即可放行
+        self.assertAlmostEqual(bucket.delay(1000, now + 0.5), 59.5)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_priority_order(self):
+        limiter = make_limiter()
+        order = []
+
+        async def waiter(priority, name):
+            await limiter.acquire("a", 10, priority)
+            order.append(name)
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                limiter.penalize("a", "0.1")
+            tasks = [asyncio.create_task(waiter(priority, name)) for priority, name in
+                     [(RateLimiter.PRIORITY_PROACTIVE, "主动"), (RateLimiter.PRIORITY_BACKGROUND, "摘要"),
+                      (RateLimiter.PRIORITY_INTERACTIVE, "回复1"), (RateLimiter.PRIORITY_INTERACTIVE, "回复2")]]
+            await asyncio.wait_for(asyncio.gather(*tasks), 2)
+
+        asyncio.run(main())
+        self.assertEqual(order, ["回复1", "回复2", "摘要", "主动"])
+        self.assertEqual(limiter.stats["acquired"], 4)
+        self.assertEqual(limiter.stats["waited"], 4)
+
+    def test_token_budget_waits(self):
+        limiter = make_limiter()
+
+        async def main():
+            await limiter.acquire("slow", 100)
+            start = time.monotonic()
+            await asyncio.wait_for(limiter.acquire("slow", 22), 3)  # 每秒补充 2 个token
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(main())
+        self.assertGreaterEqual(elapsed, 0.9)
+        self.assertEqual(limiter.stats["waited"], 1)
+
+    def test_cancelled_waiter_skipped(self):
+        limiter = make_limiter()
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                limiter.penalize("a", "0.1")
+            cancelled = asyncio.create_task(limiter.acquire("a", 1))
+            kept = asyncio.create_task(limiter.acquire("a", 1, RateLimiter.PRIORITY_PROACTIVE))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.wait_for(kept, 2)
+
+        asyncio.run(main())
+        self.assertEqual(limiter.stats["acquired"], 1)
+
+    def test_retry_after(self):
+        limiter = make_limiter()
+        with self.assertLogs("test", level="WARNING"):
+            limiter.penalize("a", "2")
+        remaining = limiter._limit("a").blocked_until - time.monotonic()
+        self.assertTrue(1.9 < remaining <= 3.0)  # 带 1~1.5 倍的随机抖动
+        self.assertTrue(limiter.blocked("a"))
+        self.assertFalse(limiter.blocked("b"))
+        self.assertEqual(limiter.stats["rate_limited"], 1)
+
+    def test_exponential_backoff(self):
+        limiter = make_limiter()
+        delays = []
+        with self.assertLogs("test", level="WARNING"):
+            for _ in range(4):
+                limit = limiter._limit("a")
+                limit.blocked_until = 0
+                limiter.penalize("a", "not a number")
+                delays.append(limit.blocked_until - time.monotonic())
+        for delay, base in zip(delays, [1.0, 2.0, 3.0, 3.0]):  # 上限为 RATE_LIMIT_BACKOFF_MAX
+            self.assertTrue(base * 0.95 < delay <= base * 1.5)
+        limiter.succeed("a")
+        self.assertEqual(limiter._limit("a").failures, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from model.ReplySegmenter import ReplySegmenter
+
+
+def run(chunks):
+    segmenter = ReplySegmenter()
+    segments = []
+    for chunk in chunks:
+        segments.extend(segmenter.feed(chunk))
+    segments.extend(segmenter.flush())
+    return segmenter, segments
+
+
+class ReplySegmenterTest(unittest.TestCase):
+    def test_split_segments(self):
+        segmenter, segments = run(["你好\\", "今天", "怎么样\\好的"])
+        self.assertEqual(segments, ["你好", "今天怎么样", "好的"])
+        self.assertEqual(segmenter.emitted, 3)
+
+    def test_strip_think(self):
+        segmenter, segments = run(["<thi", "nk>用户在问", "</think>", "你好\\再见"])
+        self.assertEqual(segments, ["你好", "再见"])
+        self.assertEqual(segmenter.text, "你好\\再见")
+
+    def test_strip_think_without_open_tag(self):
+        segmenter, segments = run(["用户在问", "</thi", "nk>你好"])
+        self.assertEqual(segments, ["你好"])
+        self.assertEqual(segmenter.text, "你好")
+
+    def test_memory_mark_suppresses_rest(self):
+        _, segments = run(["你好\\## 记忆片段\\内容"])
+        self.assertEqual(segments, ["你好"])
+
+
+if __name__ == "__main__":
+    unittest.main()
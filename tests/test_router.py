@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import time
+import unittest
+
+from model.RateLimiter import RateLimiter
+from model.Router import Provider, ProviderError, Router
+
+LOGGER = logging.getLogger("test")
+
+CONFIG = {
+    "CIRCUIT_FAILURE_THRESHOLD": 2,
+    "CIRCUIT_COOLDOWN": 0.1,
+    "RATE_LIMIT_MAX_RETRIES": 0,
+    "RATE_LIMITS": {"default": {"rpm": 6000, "tpm": 10000000}},
+    "RATE_LIMIT_BACKOFF_BASE": 1.0,
+    "RATE_LIMIT_BACKOFF_MAX": 30,
+    "HEDGE_SWITCH": False,
+    "HEDGE_MIN_DELAY": 0.05,
+    "STREAM_FIRST_BYTE_TIMEOUT": 0,
+    "LLM_PROVIDERS": [{"name": name, "base_url": f"http://{name}", "api_key": "k", "model": "m"}
+                      for name in ("a", "b")],
+}
+
+REPLY = {"choices": [{"message": {"content": "你好"}}]}
+
+
+class FakeContent:
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    async def readline(self):
+        return self.lines.pop(0) if self.lines else b""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.lines:
+            raise StopAsyncIteration
+        return self.lines.pop(0)
+
+
+class FakeResponse:
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body
+        self.content = FakeContent(body if isinstance(body, list) else [])
+        self.closed = False
+
+    async def text(self):
+        return str(self.body)
+
+    async def json(self):
+        return self.body
+
+    def release(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRequest:
+    """代替 aiohttp 的请求上下文：可以 await，也可以 async with"""
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    async def _respond(self):
+        handler = self.session.handlers[self.name]
+        self.session.calls.append(self.name)
+        try:
+            response = await handler()
+        except asyncio.CancelledError:
+            self.session.cancelled.append(self.name)
+            raise
+        self.session.responses.append((self.name, response))
+        return response
+
+    def __await__(self):
+        return self._respond().__await__()
+
+    async def __aenter__(self):
+        return await self._respond()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    def __init__(self, **handlers):
+        self.handlers = handlers
+        self.calls = []
+        self.cancelled = []
+        self.responses = []
+
+    def post(self, url, headers, json):
+        return FakeRequest(self, url.split("/")[2])
+
+
+def reply(status=200, body=REPLY, delay=0, headers=None):
+    async def handler():
+        await asyncio.sleep(delay)
+        return FakeResponse(status, body, headers)
+    return handler
+
+
+def make_router(session, **overrides):
+    config = {**CONFIG, **overrides}
+    return Router(LOGGER, config, lambda: session, RateLimiter(LOGGER, config))
+
+
+class ProviderTest(unittest.TestCase):
+    def test_circuit_open_and_half_open(self):
+        provider = Provider("a", "http://a", "k", "m", CONFIG)
+        provider.record_failure()
+        self.assertTrue(provider.available())
+        provider.record_failure()
+        self.assertEqual(provider.state, Provider.OPEN)
+        self.assertFalse(provider.available())
+
+        time.sleep(0.15)
+        self.assertTrue(provider.available())
+        self.assertEqual(provider.state, Provider.HALF_OPEN)
+        provider.begin()
+        self.assertFalse(provider.available())  # 半开状态只放行一个试探请求
+        provider.record_failure()
+        self.assertEqual(provider.state, Provider.OPEN)  # 试探失败立即重新熔断
+
+        time.sleep(0.15)
+        self.assertTrue(provider.available())
+        provider.begin()
+        provider.record_success(0.2)
+        self.assertEqual(provider.state, Provider.CLOSED)
+        self.assertTrue(provider.available())
+
+    def test_score_penalizes_errors(self):
+        healthy = Provider("a", "http://a", "k", "m", CONFIG)
+        flaky = Provider("b", "http://b", "k", "m", CONFIG)
+        for _ in range(4):
+            healthy.record_success(1.0)
+            flaky.record_success(0.5)
+        flaky.record_failure()
+        flaky.record_failure()
+        self.assertLess(healthy.score(), flaky.score())
+
+
+class RouterTest(unittest.TestCase):
+    def test_fallback_and_ranking(self):
+        session = FakeSession(a=reply(500, "down"), b=reply())
+        router = make_router(session)
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                first = await router.complete({"messages": []})
+            second = await router.complete({"messages": []})
+            return first, second
+
+        first, second = asyncio.run(main())
+        self.assertEqual(first, (REPLY, "b"))
+        self.assertEqual(second[1], "b")
+        # 失败后 a 的健康度变差，之后直接请求 b
+        self.assertEqual(session.calls, ["a", "b", "b"])
+        self.assertEqual([p.name for p in router.ranked()], ["b", "a"])
+        self.assertEqual(router.status_counts, {("a", 500): 1})
+
+    def test_circuit_open_and_half_open(self):
+        session = FakeSession(a=reply(500, "down"), b=reply(503, "busy"))
+        router = make_router(session)
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                for _ in range(3):
+                    with self.assertRaises(ProviderError):
+                        await router.complete({"messages": []})
+                self.assertEqual(session.calls, ["a", "b", "a", "b", "a"])  # 全部熔断时只试最健康的一个
+                self.assertEqual([p.state for p in router.providers], [Provider.OPEN, Provider.OPEN])
+
+                await asyncio.sleep(0.15)
+                session.handlers["b"] = reply()
+                session.calls.clear()
+                result = await router.complete({"messages": []})
+            return result
+
+        self.assertEqual(asyncio.run(main())[1], "b")
+        self.assertEqual(session.calls, ["a", "b"])
+        self.assertEqual(router.providers[0].state, Provider.OPEN)  # 半开试探失败重新熔断
+        self.assertEqual(router.providers[1].state, Provider.CLOSED)
+
+    def test_hedge_winner_cancels_loser(self):
+        session = FakeSession(a=reply(delay=1), b=reply(delay=0.01))
+        router = make_router(session, HEDGE_SWITCH=True)
+
+        async def main():
+            with self.assertLogs("test", level="INFO"):
+                result = await router.complete({"messages": []})
+            await asyncio.sleep(0)
+            return result
+
+        start = time.monotonic()
+        _, name = asyncio.run(main())
+        self.assertEqual(name, "b")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(session.cancelled, ["a"])
+        # 被取消的请求不计入失败
+        self.assertEqual(router.providers[0].consecutive_failures, 0)
+        self.assertEqual(router.providers[0].state, Provider.CLOSED)
+
+    def test_hedge_not_needed(self):
+        session = FakeSession(a=reply(), b=reply())
+        router = make_router(session, HEDGE_SWITCH=True)
+        _, name = asyncio.run(router.complete({"messages": []}))
+        self.assertEqual(name, "a")
+        self.assertEqual(session.calls, ["a"])
+
+    def test_rate_limited_falls_back_without_tripping(self):
+        session = FakeSession(a=reply(429, "slow down", headers={"Retry-After": "5"}), b=reply())
+        router = make_router(session)
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                return await router.complete({"messages": []})
+
+        _, name = asyncio.run(main())
+        self.assertEqual(name, "b")
+        self.assertEqual(router.providers[0].consecutive_failures, 0)
+        self.assertTrue(router.limiter.blocked("a"))
+        self.assertEqual(router.ranked()[-1].name, "a")  # 被限流暂停的排在最后
+
+    def test_stream_first_byte_timeout(self):
+        lines = [b'data: {"choices":[{"delta":{"content":"hi"}}]}\n', b"data: [DONE]\n"]
+        session = FakeSession(a=reply(delay=5, body=list(lines)), b=reply(body=list(lines)))
+        router = make_router(session, STREAM_FIRST_BYTE_TIMEOUT=0.1)
+
+        async def main():
+            with self.assertLogs("test", level="WARNING"):
+                return [line async for line in router.stream({"messages": []})]
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(main()), lines)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(session.cancelled, ["a"])
+        self.assertEqual(router.providers[0].consecutive_failures, 1)
+        self.assertTrue(all(response.closed for _, response in session.responses))
+
+    def test_stream_error_after_first_line_is_raised(self):
+        session = FakeSession(a=reply(body=[b"data: 1\n"]), b=reply(body=[b"data: 2\n"]))
+        router = make_router(session)
+
+        async def main():
+            received = []
+            async for line in router.stream({"messages": []}):
+                received.append(line)
+                raise ValueError("consumer failed")
+            return received
+
+        with self.assertRaises(ValueError):
+            asyncio.run(main())
+        self.assertEqual(session.calls, ["a"])  # 已产出数据后不再回退
+
+
+if __name__ == "__main__":
+    unittest.main()
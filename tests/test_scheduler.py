@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from model.Scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_due_in_deadline_order(self):
+        async def main():
+            scheduler = Scheduler()
+            scheduler.bind(asyncio.get_running_loop())
+            now = time.time()
+            scheduler.schedule("b", now - 1)
+            scheduler.schedule("a", now - 2)
+            scheduler.schedule("c", now + 60)
+            return scheduler, await scheduler.wait_due()
+
+        scheduler, due = asyncio.run(main())
+        self.assertEqual(due, ["a", "b"])
+        self.assertEqual(len(scheduler), 1)
+
+    def test_reschedule_and_cancel(self):
+        async def main():
+            scheduler = Scheduler()
+            scheduler.bind(asyncio.get_running_loop())
+            now = time.time()
+            scheduler.schedule("a", now - 1)
+            scheduler.schedule("a", now + 60)  # 重排后旧条目失效
+            scheduler.schedule("b", now - 1)
+            scheduler.cancel("b")
+            scheduler.schedule("c", now - 1)
+            return scheduler, await scheduler.wait_due()
+
+        scheduler, due = asyncio.run(main())
+        self.assertEqual(due, ["c"])
+        self.assertIsNone(scheduler.deadline("b"))
+        self.assertIsNotNone(scheduler.deadline("a"))
+
+    def test_wakeup_from_other_thread(self):
+        async def main():
+            scheduler = Scheduler()
+            scheduler.bind(asyncio.get_running_loop())
+            scheduler.schedule("late", time.time() + 60)
+            timer = threading.Timer(0.1, lambda: scheduler.schedule("early", time.time()))
+            timer.start()
+            start = time.monotonic()
+            due = await asyncio.wait_for(scheduler.wait_due(), 5)
+            timer.join()
+            return due, time.monotonic() - start
+
+        due, elapsed = asyncio.run(main())
+        self.assertEqual(due, ["early"])
+        self.assertLess(elapsed, 2)
+
+    def test_sleeps_until_deadline(self):
+        async def main():
+            scheduler = Scheduler()
+            scheduler.bind(asyncio.get_running_loop())
+            scheduler.schedule("a", time.time() + 0.2)
+            start = time.monotonic()
+            due = await asyncio.wait_for(scheduler.wait_due(), 5)
+            return due, time.monotonic() - start
+
+        due, elapsed = asyncio.run(main())
+        self.assertEqual(due, ["a"])
+        self.assertGreaterEqual(elapsed, 0.15)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import logging
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from model.StateStore import StateStore
+from model.User import User
+
+with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml"),
+          encoding="utf-8") as f:
+    CONFIG = yaml.safe_load(f)
+
+LOGGER = logging.getLogger("test")
+
+
+def make_user(name="张三", prompt_name="提示词"):
+    return User(name, prompt_name, LOGGER, CONFIG)
+
+
+class StateStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.dir.name, "temp", "state.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_snapshot_restore_round_trip(self):
+        user = make_user()
+        user.context.append("user", "你好")
+        user.context.append("assistant", "你好呀")
+        user.context.set_summary("之前聊过天气")
+        user.inbox.push("在吗", now=1000.0)
+        user.inbox.push("有事问你", now=1001.0)
+        user.proactive_sent = 2
+
+        store = StateStore(LOGGER, CONFIG, self.db_path)
+        store.mark_dirty(user)
+        self.assertEqual(store.checkpoint(), 1)
+        self.assertEqual(store.checkpoint(), 0)  # 没有新的脏用户
+        store.close()
+
+        store = StateStore(LOGGER, CONFIG, self.db_path)
+        self.assertEqual(store.pending_names(), ["张三"])
+        restored = make_user()
+        self.assertTrue(store.restore(restored))
+        self.assertEqual(restored.context.messages("系统"), user.context.messages("系统"))
+        self.assertEqual(restored.inbox.items(), ["在吗", "有事问你"])
+        self.assertEqual(restored.inbox.last_time, 1001.0)
+        self.assertEqual(restored.user_timers, user.user_timers)
+        self.assertEqual(restored.user_wait_time, user.user_wait_time)
+        self.assertEqual(restored.proactive_sent, 2)
+
+        (name, prompt_name, due, sent), = store.proactive_states()
+        self.assertEqual((name, prompt_name, sent), ("张三", "提示词", 2))
+        self.assertAlmostEqual(due, user.user_timers + user.user_wait_time)
+        store.close()
+
+    def test_prompt_change_skips_restore(self):
+        store = StateStore(LOGGER, CONFIG, self.db_path)
+        user = make_user()
+        user.context.append("user", "你好")
+        store.mark_dirty(user)
+        store.checkpoint()
+        other = make_user(prompt_name="智慧教育助手")
+        self.assertFalse(store.restore(other))
+        self.assertEqual(len(other.context), 0)
+        self.assertFalse(store.restore(make_user(name="李四")))
+        self.assertEqual(store.pending_names(), [])
+        store.close()
+
+    def test_close_writes_final_checkpoint(self):
+        store = StateStore(LOGGER, CONFIG, self.db_path)
+        store.start()
+        user = make_user()
+        user.inbox.push("在吗")
+        store.mark_dirty(user)
+        store.close()
+        self.assertEqual(store.stats["users_saved"], 1)
+        store = StateStore(LOGGER, CONFIG, self.db_path)
+        self.assertEqual(store.load("张三")["queue"], ["在吗"])
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()